@@ -1,14 +1,20 @@
 import asyncio
+import functools
+from collections import Counter
 import logging
 import os
+import re
 import shutil
+import sys
+import tempfile
 from datetime import datetime, timedelta
 
+import aiofiles
+from cachetools import TTLCache
 from telegram import (
     Update,
     InlineKeyboardButton,
     InlineKeyboardMarkup,
-    InputFile
 )
 from telegram.ext import (
     ApplicationBuilder,
@@ -19,7 +25,7 @@ from telegram.ext import (
     filters,
 )
 
-from config import BOT_TOKEN
+from config import BOT_TOKEN, DATABASE_PATH
 from session_manager import (
     add_session,
     get_all_sessions,
@@ -56,10 +62,6 @@ from file_extractors import get_file_processing_stats, clear_file_cache
 # Logging
 # ======================
 
-logging.basicConfig(
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    level=logging.INFO
-)
 logger = logging.getLogger(__name__)
 
 # ======================
@@ -67,7 +69,99 @@ logger = logging.getLogger(__name__)
 # ======================
 
 PAGE_SIZE = 20
-ADMIN_IDS = []  # أضف هنا أي دي الأدمن الخاص بك: [123456789, 987654321]
+ADMIN_IDS: frozenset = frozenset()  # أضف هنا أي دي الأدمن الخاص بك: frozenset({123456789, 987654321})
+
+# الأوامر المحصورة بالأدمن — frozenset ثابت بدل إعادة بناء القائمة في كل callback
+ADMIN_ONLY_ACTIONS = frozenset({
+    "admin_panel", "detailed_stats", "backup_menu",
+    "db_stats", "optimize_db", "clean_db", "file_stats",
+    "test_all_sessions", "delete_all_sessions", "create_backup",
+    "list_backups", "confirm_clean_db", "confirm_delete_all",
+})
+
+# جداول الأسماء العربية للعرض — بحث مباشر بدل سلاسل replace في كل استدعاء
+PLATFORM_NAME_AR = {
+    "telegram": "تيليجرام",
+    "telegram_invite_with_plus": "تيليجرام مع +",
+    "telegram_invite_without_plus": "تيليجرام بدون +",
+    "whatsapp": "واتساب",
+}
+
+CHAT_TYPE_AR = {
+    "group": "مجموعات",
+    "channel": "قنوات",
+}
+
+SOURCE_TYPE_AR = {
+    "text": "نص",
+    "button": "أزرار",
+    "comment": "تعليقات",
+    "file": "ملفات",
+}
+
+TELEGRAM_TYPE_AR = {
+    "invite_with_plus": "مع +",
+    "invite_without_plus": "بدون +",
+}
+
+# ======================
+# Message Templates
+# ======================
+
+# رؤوس الرسائل الثابتة تُبنى مرة واحدة عند الاستيراد
+# ولا يبقى في المعالجات إلا تعبئة القيم المتغيرة
+# شكل تقريبي لـ Session String (طويل ومن محارف Base64 وما شابه)
+SESSION_RE = re.compile(r"^[A-Za-z0-9+/=:_-]{100,}$")
+
+FALLBACK_PROMPT = (
+    "📝 أرسل Session String لإضافة حساب جديد\n"
+    "أو استخدم الأزرار أدناه:"
+)
+
+STATS_HDR = "📊 *إحصائيات الروابط*\n\n• إجمالي الروابط: {total}\n"
+
+STATS_SUMMARY_HDR = "📊 *إحصائيات مفصلة*\n\n• إجمالي الروابط: {total}\n\n*المنصات:*\n"
+
+TELEGRAM_STATS_HDR = "📨 *إحصائيات تليجرام*\n\n• إجمالي روابط تليجرام: {total}\n\n*حسب النوع:*\n"
+
+WHATSAPP_STATS_MSG = (
+    "📞 *إحصائيات واتساب*\n\n"
+    "• إجمالي روابط واتساب: {total}\n\n"
+    "*ملاحظة:* يتم جمع رواق واتساب من آخر 60 يوم فقط"
+)
+
+DETAILED_STATS_HDR = (
+    "📈 *إحصائيات مفصلة*\n\n"
+    "*إجمالي الروابط:*\n"
+    "• الكل: {total}\n\n"
+    "*حسب المنصة:*\n"
+)
+
+# ======================
+# Stats Cache
+# ======================
+
+# كاش قصير العمر لنتائج استعلامات الإحصائيات الثقيلة
+# حتى لا يعاد تنفيذ نفس الاستعلام لكل مستخدم
+_stats_cache: TTLCache = TTLCache(maxsize=8, ttl=30)
+_stats_cache_lock = asyncio.Lock()
+
+
+async def _cached_stats(func):
+    """تنفيذ دالة إحصائيات مع تخزين نتيجتها مؤقتاً لمدة 30 ثانية"""
+    key = func.__name__
+    async with _stats_cache_lock:
+        if key in _stats_cache:
+            return _stats_cache[key]
+        result = await asyncio.to_thread(func)
+        _stats_cache[key] = result
+        return result
+
+
+def _invalidate_stats_cache():
+    """مسح كاش الإحصائيات بعد أي تغيير في البيانات"""
+    _stats_cache.clear()
+
 
 # ======================
 # Admin Check
@@ -75,14 +169,15 @@ ADMIN_IDS = []  # أضف هنا أي دي الأدمن الخاص بك: [1234567
 
 def is_admin(user_id: int) -> bool:
     """التحقق إذا كان المستخدم أدمن"""
-    return user_id in ADMIN_IDS or len(ADMIN_IDS) == 0  # إذا لم تحدد أدمن، الجميع أدمن
+    return not ADMIN_IDS or user_id in ADMIN_IDS  # إذا لم تحدد أدمن، الجميع أدمن
 
 # ======================
 # Keyboards
 # ======================
 
-def main_keyboard(user_id: int = None):
-    """لوحة المفاتيح الرئيسية مع أزرار إضافية للأدمن"""
+@functools.lru_cache(maxsize=2)
+def _main_keyboard(admin: bool):
+    """بناء لوحة المفاتيح الرئيسية (نسخة مخزنة لكل نوع مستخدم)"""
     buttons = [
         [InlineKeyboardButton("➕ إضافة حساب", callback_data="add_account")],
         [InlineKeyboardButton("👤 عرض الحسابات", callback_data="list_accounts")],
@@ -91,19 +186,25 @@ def main_keyboard(user_id: int = None):
         [InlineKeyboardButton("📊 عرض الروابط", callback_data="view_links")],
         [InlineKeyboardButton("📤 تصدير الروابط", callback_data="export_links")],
     ]
-    
+
     # أزرار الأدمن
-    if user_id and is_admin(user_id):
+    if admin:
         admin_buttons = [
             [InlineKeyboardButton("🔧 إدارة النظام", callback_data="admin_panel")],
             [InlineKeyboardButton("📈 إحصائيات مفصلة", callback_data="detailed_stats")],
             [InlineKeyboardButton("💾 النسخ الاحتياطي", callback_data="backup_menu")],
         ]
         buttons.extend(admin_buttons)
-    
+
     return InlineKeyboardMarkup(buttons)
 
 
+def main_keyboard(user_id: int = None):
+    """لوحة المفاتيح الرئيسية مع أزرار إضافية للأدمن"""
+    return _main_keyboard(bool(user_id and is_admin(user_id)))
+
+
+@functools.lru_cache(maxsize=1)
 def admin_panel_keyboard():
     """لوحة إدارة النظام للأدمن"""
     return InlineKeyboardMarkup([
@@ -117,6 +218,7 @@ def admin_panel_keyboard():
     ])
 
 
+@functools.lru_cache(maxsize=1)
 def backup_menu_keyboard():
     """قائمة النسخ الاحتياطي"""
     return InlineKeyboardMarkup([
@@ -126,6 +228,7 @@ def backup_menu_keyboard():
     ])
 
 
+@functools.lru_cache(maxsize=1)
 def platforms_keyboard():
     """لوحة اختيار المنصات"""
     return InlineKeyboardMarkup([
@@ -135,6 +238,7 @@ def platforms_keyboard():
     ])
 
 
+@functools.lru_cache(maxsize=1)
 def telegram_types_keyboard():
     """لوحة أنواع روابط تليجرام"""
     return InlineKeyboardMarkup([
@@ -149,6 +253,7 @@ def telegram_types_keyboard():
     ])
 
 
+@functools.lru_cache(maxsize=1)
 def whatsapp_types_keyboard():
     """لوحة روابط واتساب"""
     return InlineKeyboardMarkup([
@@ -157,6 +262,7 @@ def whatsapp_types_keyboard():
     ])
 
 
+@functools.lru_cache(maxsize=512)
 def pagination_keyboard(platform, chat_type, page):
     """أزرار التصفح"""
     buttons = []
@@ -179,6 +285,7 @@ def pagination_keyboard(platform, chat_type, page):
     return InlineKeyboardMarkup([buttons])
 
 
+@functools.lru_cache(maxsize=1)
 def export_keyboard():
     """أزرار التصدير"""
     return InlineKeyboardMarkup([
@@ -194,17 +301,40 @@ def export_keyboard():
 # Helper Functions
 # ======================
 
+def _merge_files_sendfile(sources, dest):
+    """دمج الملفات عبر os.sendfile — النسخ يتم داخل النواة بدون المرور على بايثون"""
+    with open(dest, "wb") as outfile:
+        for fname in sources:
+            if os.path.exists(fname):
+                with open(fname, "rb") as infile:
+                    # sendfile قد ينقل أقل من المطلوب —
+                    # الاستمرار من الإزاحة حتى اكتمال الملف
+                    size = os.path.getsize(fname)
+                    offset = 0
+                    while offset < size:
+                        sent = os.sendfile(
+                            outfile.fileno(), infile.fileno(),
+                            offset, size - offset
+                        )
+                        if sent == 0:
+                            break
+                        offset += sent
+
+
 def format_number(number):
     """تنسيق الأرقام بفواصل"""
     return f"{number:,}"
 
+# جدول الوحدات مع معامل القسمة الجاهز — مقارنة واحدة بدل قسمة متكررة
+_SIZE_UNITS = (("B", 1), ("KB", 1024), ("MB", 1024 ** 2), ("GB", 1024 ** 3))
+
+
 def format_size(size_bytes):
     """تنسيق حجم الملف"""
-    for unit in ['B', 'KB', 'MB', 'GB']:
-        if size_bytes < 1024.0:
-            return f"{size_bytes:.2f} {unit}"
-        size_bytes /= 1024.0
-    return f"{size_bytes:.2f} TB"
+    for unit, scale in _SIZE_UNITS:
+        if size_bytes < scale * 1024:
+            return f"{size_bytes / scale:.2f} {unit}"
+    return f"{size_bytes / 1024 ** 4:.2f} TB"
 
 def format_time(seconds):
     """تنسيق الوقت"""
@@ -222,7 +352,8 @@ def format_time(seconds):
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """بدء البوت"""
     user_id = update.effective_user.id
-    await update.message.reply_text(
+    reply = update.message.reply_text
+    await reply(
         "🤖 *Telegram Multi-Account Link Collector Bot*\n\n"
         "📊 **ميزات جديدة:**\n"
         "• جمع روابط تليجرام (مع + وبدون +)\n"
@@ -239,26 +370,21 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 async def stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """إحصائيات سريعة"""
-    stats_data = get_detailed_stats()
-    
-    message = "📊 *إحصائيات الروابط*\n\n"
-    message += f"• إجمالي الروابط: {format_number(stats_data['total'])}\n"
+    reply = update.message.reply_text
+    stats_data = await _cached_stats(get_detailed_stats)
     
+    parts = [STATS_HDR.format(total=format_number(stats_data['total']))]
+
     for platform, count in stats_data['platforms'].items():
-        if platform.startswith('telegram'):
-            platform_name = platform.replace('telegram_', 'تيليجرام ').replace('_', ' ')
-        elif platform == 'whatsapp':
-            platform_name = 'واتساب'
-        else:
-            platform_name = platform
-        
-        message += f"• {platform_name}: {format_number(count)}\n"
-    
-    await update.message.reply_text(message, parse_mode="Markdown")
+        platform_name = PLATFORM_NAME_AR.get(platform, platform)
+        parts.append(f"• {platform_name}: {format_number(count)}\n")
+
+    await reply("".join(parts), parse_mode="Markdown")
 
 
 async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """مساعدة"""
+    reply = update.message.reply_text
     help_text = """
 📚 *دليل الاستخدام*
 
@@ -281,483 +407,578 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 *ملاحظة:* البوت لا يجمع روابط بوتات تليجرام
     """
-    await update.message.reply_text(help_text, parse_mode="Markdown")
+    await reply(help_text, parse_mode="Markdown")
 
 
 # ======================
 # Callbacks
 # ======================
 
-async def callbacks(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """معالجة Callback Queries"""
-    query = update.callback_query
-    user_id = update.effective_user.id
-    
-    if not is_admin(user_id) and query.data in ["admin_panel", "detailed_stats", "backup_menu", 
-                                               "db_stats", "optimize_db", "clean_db", "file_stats",
-                                               "test_all_sessions", "delete_all_sessions", "create_backup",
-                                               "list_backups"]:
-        await query.answer("⛔ هذا الأمر للأدمن فقط!", show_alert=True)
+async def _cb_add_account(update: Update, context: ContextTypes.DEFAULT_TYPE, query, data):
+    """➕ إضافة حساب"""
+    context.user_data["awaiting_session"] = True
+    await query.edit_message_text("📥 أرسل Session String الآن:\n\n"
+                                 "*ملاحظة:* يجب أن يكون الحساب نشط وليس بوت")
+
+
+async def _cb_list_accounts(update: Update, context: ContextTypes.DEFAULT_TYPE, query, data):
+    """👤 عرض الحسابات"""
+    sessions = get_all_sessions()
+    if not sessions:
+        await query.edit_message_text("❌ لا يوجد حسابات مضافة.")
         return
-    
-    await query.answer()
-    data = query.data
 
-    # ➕ إضافة حساب
-    if data == "add_account":
-        context.user_data["awaiting_session"] = True
-        await query.edit_message_text("📥 أرسل Session String الآن:\n\n"
-                                     "*ملاحظة:* يجب أن يكون الحساب نشط وليس بوت")
-
-    # 👤 عرض الحسابات
-    elif data == "list_accounts":
-        sessions = get_all_sessions()
-        if not sessions:
-            await query.edit_message_text("❌ لا يوجد حسابات مضافة.")
-            return
+    text = "👤 *الحسابات المضافة:*\n\n"
+    buttons = []
 
-        text = "👤 *الحسابات المضافة:*\n\n"
-        buttons = []
-        
-        for s in sessions:
-            status_emoji = "🟢" if s['status'] == 'active' else "🔴" if s['status'] == 'error' else "🟡"
-            text += f"{status_emoji} {s['name']}\n"
-            text += f"   📱 {s['phone'] or 'غير معروف'}\n"
-            text += f"   📅 {s['added_date'][:10] if s['added_date'] else 'غير معروف'}\n\n"
-            
-            buttons.append([
-                InlineKeyboardButton(
-                    f"🗑 حذف {s['name'][:15]}",
-                    callback_data=f"delete_account:{s['id']}"
-                ),
-                InlineKeyboardButton(
-                    f"🧪 اختبار",
-                    callback_data=f"test_session:{s['id']}"
-                )
-            ])
+    for s in sessions:
+        status_emoji = "🟢" if s['status'] == 'active' else "🔴" if s['status'] == 'error' else "🟡"
+        text += f"{status_emoji} {s['name']}\n"
+        text += f"   📱 {s['phone'] or 'غير معروف'}\n"
+        text += f"   📅 {s['added_date'][:10] if s['added_date'] else 'غير معروف'}\n\n"
 
-        buttons.append([InlineKeyboardButton("↩️ العودة", callback_data="back_to_main")])
-        
-        await query.edit_message_text(
-            text[:4000],
-            reply_markup=InlineKeyboardMarkup(buttons),
-            parse_mode="Markdown"
-        )
+        buttons.append([
+            InlineKeyboardButton(
+                f"🗑 حذف {s['name'][:15]}",
+                callback_data=f"delete_account:{s['id']}"
+            ),
+            InlineKeyboardButton(
+                f"🧪 اختبار",
+                callback_data=f"test_session:{s['id']}"
+            )
+        ])
 
-    elif data.startswith("delete_account:"):
-        session_id = int(data.split(":")[1])
-        delete_session(session_id)
-        await query.edit_message_text("✅ تم حذف الحساب.")
-        await asyncio.sleep(1)
-        await start(update, context)
-
-    elif data.startswith("test_session:"):
-        session_id = int(data.split(":")[1])
-        result = await test_session(session_id)
-        
-        if result["success"]:
-            await query.answer("✅ الجلسة صالحة!", show_alert=True)
-        else:
-            await query.answer(f"❌ {result['message']}", show_alert=True)
+    buttons.append([InlineKeyboardButton("↩️ العودة", callback_data="back_to_main")])
 
-    # ▶️ بدء الجمع
-    elif data == "start_collect":
-        if is_collecting():
-            await query.answer("⏳ الجمع يعمل بالفعل!", show_alert=True)
-            return
+    await query.edit_message_text(
+        text[:4000],
+        reply_markup=InlineKeyboardMarkup(buttons),
+        parse_mode="Markdown"
+    )
 
-        await query.edit_message_text("⏳ جاري بدء عملية الجمع...")
-        asyncio.create_task(start_collection())
-        await query.edit_message_text("✅ بدأ الجمع بنجاح!\n\n"
-                                     "📊 *الميزات النشطة:*\n"
-                                     "• جمع روابط تليجرام\n"
-                                     "• جمع روابط واتساب (60 يوم)\n"
-                                     "• استخراج من الملفات\n"
-                                     "• استخراج من التعليقات")
-
-    # ⏹ إيقاف الجمع
-    elif data == "stop_collect":
-        if not is_collecting():
-            await query.answer("⏸ الجمع متوقف بالفعل!", show_alert=True)
-            return
 
-        stop_collection()
-        await query.edit_message_text("⏹ تم إيقاف الجمع.\n\n"
-                                     "*ملاحظة:* تم حفظ جميع الروابط المجمعة")
+async def _cb_delete_account(update: Update, context: ContextTypes.DEFAULT_TYPE, query, data):
+    """🗑 حذف حساب واحد"""
+    session_id = int(data[len("delete_account:"):])
+    delete_session(session_id)
+    await query.edit_message_text("✅ تم حذف الحساب.")
+    await asyncio.sleep(1)
+    await start(update, context)
 
-    # 📊 عرض الروابط
-    elif data == "view_links":
-        await query.edit_message_text(
-            "📊 اختر المنصة:",
-            reply_markup=platforms_keyboard()
-        )
 
-    # 📈 الإحصائيات
-    elif data == "stats_summary":
-        stats_data = get_detailed_stats()
-        
-        message = "📊 *إحصائيات مفصلة*\n\n"
-        message += f"• إجمالي الروابط: {format_number(stats_data['total'])}\n\n"
-        
-        message += "*المنصات:*\n"
-        for platform, count in stats_data['platforms'].items():
-            if platform.startswith('telegram'):
-                platform_name = platform.replace('telegram_', 'تيليجرام ').replace('_', ' ')
-            elif platform == 'whatsapp':
-                platform_name = 'واتساب'
-            else:
-                platform_name = platform
-            
-            message += f"• {platform_name}: {format_number(count)}\n"
-        
-        message += "\n*أنواع المحادثات:*\n"
-        for chat_type, count in stats_data['chat_types'].items():
-            chat_name = "مجموعات" if chat_type == "group" else "قنوات" if chat_type == "channel" else chat_type
-            message += f"• {chat_name}: {format_number(count)}\n"
-        
-        await query.edit_message_text(message[:4000], parse_mode="Markdown")
-
-    elif data == "telegram_stats":
-        stats_data = get_detailed_stats()
-        message = "📨 *إحصائيات تليجرام*\n\n"
-        
-        telegram_count = sum(count for platform, count in stats_data['platforms'].items() 
-                           if platform.startswith('telegram'))
-        message += f"• إجمالي روابط تليجرام: {format_number(telegram_count)}\n\n"
-        
-        message += "*حسب النوع:*\n"
-        for t_type, count in stats_data.get('telegram_types', {}).items():
-            type_name = "مع +" if "with_plus" in t_type else "بدون +"
-            message += f"• {type_name}: {format_number(count)}\n"
-        
-        await query.edit_message_text(message, parse_mode="Markdown")
-
-    elif data == "whatsapp_stats":
-        stats_data = get_detailed_stats()
-        whatsapp_count = stats_data['platforms'].get('whatsapp', 0)
-        
-        message = "📞 *إحصائيات واتساب*\n\n"
-        message += f"• إجمالي روابط واتساب: {format_number(whatsapp_count)}\n\n"
-        message += "*ملاحظة:* يتم جمع رواق واتساب من آخر 60 يوم فقط"
-        
-        await query.edit_message_text(message, parse_mode="Markdown")
-
-    # اختيار منصة
-    elif data == "choose:telegram":
-        await query.edit_message_text(
-            "📨 روابط تيليجرام:",
-            reply_markup=telegram_types_keyboard()
-        )
+async def _cb_test_session(update: Update, context: ContextTypes.DEFAULT_TYPE, query, data):
+    """🧪 اختبار جلسة واحدة"""
+    session_id = int(data[len("test_session:"):])
+    result = await test_session(session_id)
 
-    elif data == "choose:whatsapp":
-        await query.edit_message_text(
-            "📞 روابط واتساب:",
-            reply_markup=whatsapp_types_keyboard()
-        )
+    if result["success"]:
+        await query.answer("✅ الجلسة صالحة!", show_alert=True)
+    else:
+        await query.answer(f"❌ {result['message']}", show_alert=True)
 
-    # عرض روابط
-    elif data.startswith("links:"):
-        _, platform, chat_type, page = data.split(":")
-        page = int(page)
-
-        if platform.startswith('telegram_'):
-            # روابط تليجرام حسب النوع
-            links = get_links_by_telegram_type(
-                telegram_type=platform.replace('telegram_', ''),
-                limit=PAGE_SIZE,
-                offset=page * PAGE_SIZE
-            )
-        else:
-            links = get_links_by_platform_and_type(
-                platform=platform,
-                chat_type=chat_type,
-                limit=PAGE_SIZE,
-                offset=page * PAGE_SIZE
-            )
 
-        if not links and page == 0:
-            await query.answer("❌ لا توجد روابط!", show_alert=True)
-            return
+async def _cb_start_collect(update: Update, context: ContextTypes.DEFAULT_TYPE, query, data):
+    """▶️ بدء الجمع"""
+    if is_collecting():
+        await query.answer("⏳ الجمع يعمل بالفعل!", show_alert=True)
+        return
 
-        # إنشاء العنوان
-        if platform.startswith('telegram_'):
-            type_name = "مع +" if "with_plus" in platform else "بدون +"
-            title = f"تيليجرام ({type_name})"
-        else:
-            platform_names = {
-                'whatsapp': 'واتساب',
-                'telegram': 'تيليجرام'
-            }
-            chat_names = {
-                'group': 'مجموعات',
-                'channel': 'قنوات'
-            }
-            title = f"{platform_names.get(platform, platform)} / {chat_names.get(chat_type, chat_type)}"
-
-        text = f"🔗 *روابط {title} – صفحة {page + 1}*\n\n"
-
-        for item in links:
-            if len(item) == 4:  # رابط مع معلومات إضافية
-                url, platform_info, chat_type_info, date = item
-            else:  # رابط مع التاريخ فقط
-                url, date = item[0], item[-1]
-            
-            year = date[:4] if date else "----"
-            text += f"[{year}] {url}\n"
+    _invalidate_stats_cache()
 
-        await query.edit_message_text(
-            text[:4000],
-            reply_markup=pagination_keyboard(platform, chat_type, page),
-            parse_mode="Markdown"
-        )
+    # مهمة مُشرف عليها: ننتظر اكتمال التهيئة فقط ثم نرسل تعديلاً واحداً للرسالة
+    started = asyncio.Event()
+    collect_task = asyncio.create_task(start_collection(started))
+    context.application.bot_data["collect_task"] = collect_task
+    await started.wait()
+
+    await query.edit_message_text("✅ بدأ الجمع بنجاح!\n\n"
+                                 "📊 *الميزات النشطة:*\n"
+                                 "• جمع روابط تليجرام\n"
+                                 "• جمع روابط واتساب (60 يوم)\n"
+                                 "• استخراج من الملفات\n"
+                                 "• استخراج من التعليقات")
+
+
+async def _cb_stop_collect(update: Update, context: ContextTypes.DEFAULT_TYPE, query, data):
+    """⏹ إيقاف الجمع"""
+    if not is_collecting():
+        await query.answer("⏸ الجمع متوقف بالفعل!", show_alert=True)
+        return
+
+    stop_collection()
+    context.application.bot_data.pop("collect_task", None)
+    _invalidate_stats_cache()
+    await query.edit_message_text("⏹ تم إيقاف الجمع.\n\n"
+                                 "*ملاحظة:* تم حفظ جميع الروابط المجمعة")
+
+
+async def _cb_view_links(update: Update, context: ContextTypes.DEFAULT_TYPE, query, data):
+    """📊 عرض الروابط"""
+    await query.edit_message_text(
+        "📊 اختر المنصة:",
+        reply_markup=platforms_keyboard()
+    )
+
+
+async def _cb_stats_summary(update: Update, context: ContextTypes.DEFAULT_TYPE, query, data):
+    """📈 الإحصائيات"""
+    stats_data = await _cached_stats(get_detailed_stats)
+
+    parts = [STATS_SUMMARY_HDR.format(total=format_number(stats_data['total']))]
+    for platform, count in stats_data['platforms'].items():
+        platform_name = PLATFORM_NAME_AR.get(platform, platform)
+        parts.append(f"• {platform_name}: {format_number(count)}\n")
+
+    parts.append("\n*أنواع المحادثات:*\n")
+    for chat_type, count in stats_data['chat_types'].items():
+        chat_name = CHAT_TYPE_AR.get(chat_type, chat_type)
+        parts.append(f"• {chat_name}: {format_number(count)}\n")
+
+    message = "".join(parts)
+    await query.edit_message_text(message[:4000], parse_mode="Markdown")
+
+
+async def _cb_telegram_stats(update: Update, context: ContextTypes.DEFAULT_TYPE, query, data):
+    """📨 إحصائيات تليجرام"""
+    stats_data = await _cached_stats(get_detailed_stats)
+    telegram_count = sum(count for platform, count in stats_data['platforms'].items() 
+                       if platform.startswith('telegram'))
+
+    parts = [TELEGRAM_STATS_HDR.format(total=format_number(telegram_count))]
+    for t_type, count in stats_data.get('telegram_types', {}).items():
+        type_name = TELEGRAM_TYPE_AR.get(t_type, t_type)
+        parts.append(f"• {type_name}: {format_number(count)}\n")
+
+    await query.edit_message_text("".join(parts), parse_mode="Markdown")
+
+
+async def _cb_whatsapp_stats(update: Update, context: ContextTypes.DEFAULT_TYPE, query, data):
+    """📞 إحصائيات واتساب"""
+    stats_data = await _cached_stats(get_detailed_stats)
+    whatsapp_count = stats_data['platforms'].get('whatsapp', 0)
+
+    message = WHATSAPP_STATS_MSG.format(total=format_number(whatsapp_count))
+
+    await query.edit_message_text(message, parse_mode="Markdown")
+
+
+async def _cb_choose_telegram(update: Update, context: ContextTypes.DEFAULT_TYPE, query, data):
+    """اختيار منصة تليجرام"""
+    await query.edit_message_text(
+        "📨 روابط تيليجرام:",
+        reply_markup=telegram_types_keyboard()
+    )
+
+
+async def _cb_choose_whatsapp(update: Update, context: ContextTypes.DEFAULT_TYPE, query, data):
+    """اختيار منصة واتساب"""
+    await query.edit_message_text(
+        "📞 روابط واتساب:",
+        reply_markup=whatsapp_types_keyboard()
+    )
 
-    # 📤 تصدير الروابط
-    elif data == "export_links":
-        await query.edit_message_text(
-            "📤 اختر نوع التصدير:",
-            reply_markup=export_keyboard()
+
+async def _cb_links(update: Update, context: ContextTypes.DEFAULT_TYPE, query, data):
+    """عرض روابط مع التصفح"""
+    # links:platform:chat_type:page — تحليل بدون إنشاء قائمة وسيطة
+    _, _, rest = data.partition(":")
+    platform, _, rest = rest.partition(":")
+    chat_type, _, page_s = rest.partition(":")
+    page = int(page_s)
+
+    # مؤشرات الترقيم بالمفتاح محفوظة لكل مستخدم —
+    # OFFSET يبقى احتياطاً عند غياب المؤشر (مثلاً بعد إعادة التشغيل)
+    cursors = context.user_data.setdefault("link_cursors", {})
+    before = cursors.get((platform, chat_type, page)) if page > 0 else None
+
+    if platform.startswith('telegram_'):
+        # روابط تليجرام حسب النوع
+        links = get_links_by_telegram_type(
+            telegram_type=platform.replace('telegram_', ''),
+            limit=PAGE_SIZE,
+            offset=page * PAGE_SIZE,
+            before=before
+        )
+    else:
+        links = get_links_by_platform_and_type(
+            platform=platform,
+            chat_type=chat_type,
+            limit=PAGE_SIZE,
+            offset=page * PAGE_SIZE,
+            before=before
         )
 
-    elif data.startswith("export:"):
-        platform = data.split(":")[1]
-        
-        await query.edit_message_text("⏳ جاري تصدير الروابط...")
-        
-        if platform == "telegram_all":
-            # تصدير جميع روابط تليجرام
-            path = export_links("telegram_invite_with_plus")
-            path2 = export_links("telegram_invite_without_plus")
-            
-            if path and path2:
-                # دمج الملفات
-                merged_path = "exports/telegram_all.txt"
-                with open(merged_path, 'w', encoding='utf-8') as outfile:
-                    for fname in [path, path2]:
-                        if os.path.exists(fname):
-                            with open(fname, 'r', encoding='utf-8') as infile:
-                                outfile.write(infile.read())
-                
-                with open(merged_path, "rb") as f:
-                    await query.message.reply_document(
-                        document=InputFile(f, filename="telegram_all.txt"),
-                        caption="📨 جميع روابط تليجرام"
-                    )
-            else:
-                await query.answer("❌ لا توجد روابط تليجرام!", show_alert=True)
-        else:
-            path = export_links(platform)
-            
-            if not path or not os.path.exists(path):
-                await query.answer("❌ لا توجد روابط!", show_alert=True)
-                return
+    if not links:
+        # صفحة فارغة أيضاً عند تجاوز آخر صفحة بزر "التالي"
+        msg = "❌ لا توجد روابط!" if page == 0 else "❌ لا توجد صفحات أخرى!"
+        await query.answer(msg, show_alert=True)
+        return
+
+    # إنشاء العنوان
+    if platform.startswith('telegram_'):
+        type_name = "مع +" if "with_plus" in platform else "بدون +"
+        title = f"تيليجرام ({type_name})"
+    else:
+        title = f"{PLATFORM_NAME_AR.get(platform, platform)} / {CHAT_TYPE_AR.get(chat_type, chat_type)}"
+
+    # حفظ مؤشر الصفحة التالية (التاريخ + id من آخر صف)
+    cursors[(platform, chat_type, page + 1)] = (links[-1][-2], links[-1][-1])
 
-            with open(path, "rb") as f:
-                await query.message.reply_document(
-                    document=InputFile(f, filename=os.path.basename(path)),
-                    caption=f"📤 روابط {platform}"
+    # الرابط أول عمود، التاريخ قبل الأخير (الأخير هو id المؤشر)
+    lines = [f"[{(item[-2] or '----')[:4]}] {item[0]}" for item in links]
+    text = f"🔗 *روابط {title} – صفحة {page + 1}*\n\n" + "\n".join(lines) + "\n"
+
+    await query.edit_message_text(
+        text[:4000],
+        reply_markup=pagination_keyboard(platform, chat_type, page),
+        parse_mode="Markdown"
+    )
+
+
+async def _cb_export_links(update: Update, context: ContextTypes.DEFAULT_TYPE, query, data):
+    """📤 قائمة التصدير"""
+    await query.edit_message_text(
+        "📤 اختر نوع التصدير:",
+        reply_markup=export_keyboard()
+    )
+
+
+async def _cb_export(update: Update, context: ContextTypes.DEFAULT_TYPE, query, data):
+    """📤 تصدير الروابط حسب المنصة"""
+    platform = data.partition(":")[2]
+
+    await query.edit_message_text("⏳ جاري تصدير الروابط...")
+
+    if platform == "telegram_all":
+        # تصدير جميع روابط تليجرام
+        path = await asyncio.to_thread(export_links, "telegram_invite_with_plus")
+        path2 = await asyncio.to_thread(export_links, "telegram_invite_without_plus")
+
+        if path and path2:
+            # دمج الملفات بدون حجب حلقة الأحداث
+            merged_path = "exports/telegram_all.txt"
+            if sys.platform == "linux":
+                # نسخ صفري داخل النواة على لينكس
+                await asyncio.to_thread(
+                    _merge_files_sendfile, (path, path2), merged_path
                 )
+            else:
+                async with aiofiles.open(merged_path, "wb") as outfile:
+                    for fname in (path, path2):
+                        if os.path.exists(fname):
+                            async with aiofiles.open(fname, "rb") as infile:
+                                while chunk := await infile.read(65536):
+                                    await outfile.write(chunk)
+
+            # تمرير المسار مباشرة — PTB يرفع الملف على دفعات بدل قراءته كاملاً في الذاكرة
+            await query.message.reply_document(
+                document=merged_path,
+                filename="telegram_all.txt",
+                caption="📨 جميع روابط تليجرام"
+            )
+        else:
+            await query.answer("❌ لا توجد روابط تليجرام!", show_alert=True)
+    else:
+        path = await asyncio.to_thread(export_links, platform)
 
-    elif data.startswith("export_telegram:"):
-        telegram_type = data.split(":")[1]
-        await query.edit_message_text("⏳ جاري تصدير الروابط...")
-        
-        path = export_links("telegram", telegram_type)
-        
         if not path or not os.path.exists(path):
             await query.answer("❌ لا توجد روابط!", show_alert=True)
             return
 
-        type_name = "مع +" if telegram_type == "invite_with_plus" else "بدون +"
-        with open(path, "rb") as f:
-            await query.message.reply_document(
-                document=InputFile(f, filename=f"telegram_{telegram_type}.txt"),
-                caption=f"📨 روابط تليجرام ({type_name})"
-            )
-
-    # 🔧 لوحة الأدمن
-    elif data == "admin_panel":
-        await query.edit_message_text(
-            "🔧 *لوحة إدارة النظام*\n\n"
-            "اختر الأمر المطلوب:",
-            reply_markup=admin_panel_keyboard(),
-            parse_mode="Markdown"
+        await query.message.reply_document(
+            document=path,
+            filename=os.path.basename(path),
+            caption=f"📤 روابط {platform}"
         )
 
-    elif data == "detailed_stats":
-        stats_data = get_detailed_stats()
-        
-        message = "📈 *إحصائيات مفصلة*\n\n"
-        
-        message += "*إجمالي الروابط:*\n"
-        message += f"• الكل: {format_number(stats_data['total'])}\n\n"
-        
-        message += "*حسب المنصة:*\n"
-        for platform, count in stats_data['platforms'].items():
-            platform_name = platform.replace('telegram_', 'تيليجرام ').replace('_', ' ')
-            platform_name = platform_name.replace('whatsapp', 'واتساب')
-            message += f"• {platform_name}: {format_number(count)}\n"
-        
-        message += "\n*حسب نوع المحادثة:*\n"
-        for chat_type, count in stats_data['chat_types'].items():
-            chat_name = "مجموعات" if chat_type == "group" else "قنوات" if chat_type == "channel" else chat_type
-            message += f"• {chat_name}: {format_number(count)}\n"
-        
-        message += "\n*حسب المصدر:*\n"
-        for source_type, count in stats_data.get('source_types', {}).items():
-            source_name = {
-                'text': 'نص',
-                'button': 'أزرار',
-                'comment': 'تعليقات',
-                'file': 'ملفات'
-            }.get(source_type, source_type)
-            message += f"• {source_name}: {format_number(count)}\n"
-        
-        await query.edit_message_text(message[:4000], parse_mode="Markdown")
-
-    elif data == "backup_menu":
-        await query.edit_message_text(
-            "💾 *قائمة النسخ الاحتياطي*\n\n"
-            "اختر الأمر المطلوب:",
-            reply_markup=backup_menu_keyboard(),
+
+async def _cb_export_telegram(update: Update, context: ContextTypes.DEFAULT_TYPE, query, data):
+    """📤 تصدير روابط تليجرام حسب النوع"""
+    telegram_type = data.partition(":")[2]
+    await query.edit_message_text("⏳ جاري تصدير الروابط...")
+
+    path = await asyncio.to_thread(export_links, "telegram", telegram_type)
+
+    if not path or not os.path.exists(path):
+        await query.answer("❌ لا توجد روابط!", show_alert=True)
+        return
+
+    type_name = TELEGRAM_TYPE_AR.get(telegram_type, telegram_type)
+    await query.message.reply_document(
+        document=path,
+        filename=f"telegram_{telegram_type}.txt",
+        caption=f"📨 روابط تليجرام ({type_name})"
+    )
+
+
+async def _cb_admin_panel(update: Update, context: ContextTypes.DEFAULT_TYPE, query, data):
+    """🔧 لوحة الأدمن"""
+    await query.edit_message_text(
+        "🔧 *لوحة إدارة النظام*\n\n"
+        "اختر الأمر المطلوب:",
+        reply_markup=admin_panel_keyboard(),
+        parse_mode="Markdown"
+    )
+
+
+async def _cb_detailed_stats(update: Update, context: ContextTypes.DEFAULT_TYPE, query, data):
+    """📈 إحصائيات مفصلة"""
+    stats_data = await _cached_stats(get_detailed_stats)
+
+    parts = [DETAILED_STATS_HDR.format(total=format_number(stats_data['total']))]
+    for platform, count in stats_data['platforms'].items():
+        platform_name = PLATFORM_NAME_AR.get(platform, platform)
+        parts.append(f"• {platform_name}: {format_number(count)}\n")
+
+    parts.append("\n*حسب نوع المحادثة:*\n")
+    for chat_type, count in stats_data['chat_types'].items():
+        chat_name = CHAT_TYPE_AR.get(chat_type, chat_type)
+        parts.append(f"• {chat_name}: {format_number(count)}\n")
+
+    parts.append("\n*حسب المصدر:*\n")
+    for source_type, count in stats_data.get('source_types', {}).items():
+        source_name = SOURCE_TYPE_AR.get(source_type, source_type)
+        parts.append(f"• {source_name}: {format_number(count)}\n")
+
+    message = "".join(parts)
+    await query.edit_message_text(message[:4000], parse_mode="Markdown")
+
+
+async def _cb_backup_menu(update: Update, context: ContextTypes.DEFAULT_TYPE, query, data):
+    """💾 قائمة النسخ الاحتياطي"""
+    await query.edit_message_text(
+        "💾 *قائمة النسخ الاحتياطي*\n\n"
+        "اختر الأمر المطلوب:",
+        reply_markup=backup_menu_keyboard(),
+        parse_mode="Markdown"
+    )
+
+
+async def _cb_create_backup(update: Update, context: ContextTypes.DEFAULT_TYPE, query, data):
+    """💾 إنشاء نسخة احتياطية"""
+    edit = query.edit_message_text
+    await edit("⏳ جاري إنشاء نسخة احتياطية...")
+    backup_file = await asyncio.to_thread(create_backup)
+
+    if backup_file:
+        file_size = os.path.getsize(backup_file)
+        await edit(
+            f"✅ تم إنشاء النسخة الاحتياطية\n\n"
+            f"📁 الملف: `{os.path.basename(backup_file)}`\n"
+            f"📊 الحجم: {format_size(file_size)}\n"
+            f"📅 الوقت: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}",
             parse_mode="Markdown"
         )
+    else:
+        await edit("❌ فشل إنشاء النسخة الاحتياطية")
 
-    elif data == "create_backup":
-        await query.edit_message_text("⏳ جاري إنشاء نسخة احتياطية...")
-        backup_file = create_backup()
-        
-        if backup_file:
-            file_size = os.path.getsize(backup_file)
-            await query.edit_message_text(
-                f"✅ تم إنشاء النسخة الاحتياطية\n\n"
-                f"📁 الملف: `{os.path.basename(backup_file)}`\n"
-                f"📊 الحجم: {format_size(file_size)}\n"
-                f"📅 الوقت: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}",
-                parse_mode="Markdown"
-            )
-        else:
-            await query.edit_message_text("❌ فشل إنشاء النسخة الاحتياطية")
 
-    elif data == "list_backups":
-        backups = list_backups()
-        
-        if not backups:
-            await query.edit_message_text("❌ لا توجد نسخ احتياطية")
-            return
-        
-        message = "📋 *قائمة النسخ الاحتياطية*\n\n"
-        
-        for backup in backups[:10]:  # عرض أول 10 نسخ فقط
-            message += f"📁 *{backup['filename']}*\n"
-            message += f"   📅 {backup['date']}\n"
-            message += f"   📊 {backup['size_mb']} MB\n\n"
-        
-        if len(backups) > 10:
-            message += f"*ومزيد {len(backups) - 10} نسخة...*\n"
-        
-        await query.edit_message_text(message, parse_mode="Markdown")
-
-    elif data == "db_stats":
-        db_size = get_database_size()
-        session_stats = get_session_stats()
-        
-        message = "🗄️ *إحصائيات قاعدة البيانات*\n\n"
-        
-        message += "*الحجم:*\n"
-        message += f"• الحجم الكلي: {db_size['total_size_mb']} MB\n"
-        message += f"• عدد الروابط: {format_number(db_size['total_links'])}\n\n"
-        
-        message += "*الجلسات:*\n"
-        message += f"• النشطة: {session_stats['active']}\n"
-        message += f"• المعطلة: {session_stats['error']}\n"
-        message += f"• الكل: {session_stats['total']}\n\n"
-        
-        message += "*أحجام الجداول:*\n"
-        for table in db_size.get('table_sizes', []):
-            message += f"• {table['table']}: {table['size_mb']:.2f} MB\n"
-        
-        await query.edit_message_text(message, parse_mode="Markdown")
-
-    elif data == "optimize_db":
-        await query.edit_message_text("⏳ جاري تحسين قاعدة البيانات...")
-        optimize_database()
-        await query.edit_message_text("✅ تم تحسين قاعدة البيانات بنجاح")
-
-    elif data == "clean_db":
-        await query.edit_message_text("⚠️ *تنبيه:*\n\n"
-                                     "سيتم تنظيف قاعدة البيانات من التكرارات\n"
-                                     "وسيتم إنشاء نسخة احتياطية تلقائياً\n\n"
-                                     "هل أنت متأكد؟",
-                                     reply_markup=InlineKeyboardMarkup([
-                                         [InlineKeyboardButton("✅ نعم، تابع", callback_data="confirm_clean_db")],
-                                         [InlineKeyboardButton("❌ لا، إلغاء", callback_data="admin_panel")]
-                                     ]),
-                                     parse_mode="Markdown")
-
-    elif data == "confirm_clean_db":
-        await query.edit_message_text("⏳ جاري التنظيف مع النسخ الاحتياطي...")
-        success = clean_database()
-        
-        if success:
-            await query.edit_message_text("✅ تم تنظيف قاعدة البيانات بنجاح")
-        else:
-            await query.edit_message_text("❌ فشل تنظيف قاعدة البيانات")
-
-    elif data == "file_stats":
-        file_stats = get_file_processing_stats()
-        
-        message = "📂 *إحصائيات معالجة الملفات*\n\n"
-        
-        message += f"• الملفات في الكاش: {file_stats['cache_size']}\n"
-        message += f"• الروابط المستخرجة: {format_number(file_stats['total_links_extracted'])}\n\n"
-        
-        if file_stats.get('file_types'):
-            message += "*حسب نوع الملف:*\n"
-            for file_type, count in file_stats['file_types'].items():
-                message += f"• {file_type.upper()}: {count}\n"
-        
-        await query.edit_message_text(message, parse_mode="Markdown")
-
-    elif data == "test_all_sessions":
-        await query.edit_message_text("⏳ جاري اختبار جميع الجلسات...")
-        results = await check_all_sessions_health()
-        
-        healthy = sum(1 for r in results if r['status'] == 'healthy')
-        unhealthy = sum(1 for r in results if r['status'] == 'unhealthy')
-        
-        message = f"🧪 *نتائج اختبار الجلسات*\n\n"
-        message += f"✅ النشطة: {healthy}\n"
-        message += f"❌ المعطلة: {unhealthy}\n"
-        message += f"📊 المجموع: {len(results)}\n\n"
-        
-        if unhealthy > 0:
-            message += "*الجلسات المعطلة:*\n"
-            for result in results:
-                if result['status'] == 'unhealthy':
-                    message += f"• {result['name']}: {result.get('error', 'خطأ غير معروف')}\n"
-        
-        await query.edit_message_text(message[:4000], parse_mode="Markdown")
-
-    elif data == "delete_all_sessions":
-        await query.edit_message_text("⚠️ *تحذير شديد:*\n\n"
-                                     "سيتم حذف جميع الحسابات المضافة!\n"
-                                     "لا يمكن التراجع عن هذا الإجراء\n\n"
-                                     "هل أنت متأكد تماماً؟",
-                                     reply_markup=InlineKeyboardMarkup([
-                                         [InlineKeyboardButton("🔥 نعم، احذف الكل", callback_data="confirm_delete_all")],
-                                         [InlineKeyboardButton("❌ إلغاء", callback_data="admin_panel")]
-                                     ]),
-                                     parse_mode="Markdown")
-
-    elif data == "confirm_delete_all":
-        deleted_count = delete_all_sessions()
-        await query.edit_message_text(f"✅ تم حذف جميع الحسابات ({deleted_count})")
-
-    elif data == "back_to_main":
-        await start(update, context)
+async def _cb_list_backups(update: Update, context: ContextTypes.DEFAULT_TYPE, query, data):
+    """📋 قائمة النسخ الاحتياطية"""
+    backups = await asyncio.to_thread(list_backups)
+
+    if not backups:
+        await query.edit_message_text("❌ لا توجد نسخ احتياطية")
+        return
+
+    parts = ["📋 *قائمة النسخ الاحتياطية*\n\n"]
 
+    for backup in backups[:10]:  # عرض أول 10 نسخ فقط
+        parts.append(f"📁 *{backup['filename']}*\n")
+        parts.append(f"   📅 {backup['date']}\n")
+        parts.append(f"   📊 {backup['size_mb']} MB\n\n")
+
+    if len(backups) > 10:
+        parts.append(f"*ومزيد {len(backups) - 10} نسخة...*\n")
+
+    await query.edit_message_text("".join(parts), parse_mode="Markdown")
+
+
+async def _cb_db_stats(update: Update, context: ContextTypes.DEFAULT_TYPE, query, data):
+    """🗄️ إحصائيات قاعدة البيانات"""
+    db_size = await _cached_stats(get_database_size)
+    session_stats = await _cached_stats(get_session_stats)
+
+    parts = [
+        "🗄️ *إحصائيات قاعدة البيانات*\n\n",
+        "*الحجم:*\n",
+        f"• الحجم الكلي: {db_size['total_size_mb']} MB\n",
+        f"• عدد الروابط: {format_number(db_size['total_links'])}\n\n",
+        "*الجلسات:*\n",
+        f"• النشطة: {session_stats['active']}\n",
+        f"• المعطلة: {session_stats['error']}\n",
+        f"• الكل: {session_stats['total']}\n\n",
+        "*أحجام الجداول:*\n",
+    ]
+    for table in db_size.get('table_sizes', []):
+        parts.append(f"• {table['table']}: {table['size_mb']:.2f} MB\n")
+
+    await query.edit_message_text("".join(parts), parse_mode="Markdown")
+
+
+async def _cb_optimize_db(update: Update, context: ContextTypes.DEFAULT_TYPE, query, data):
+    """⚙️ تحسين قاعدة البيانات"""
+    edit = query.edit_message_text
+    await edit("⏳ جاري تحسين قاعدة البيانات...")
+    await asyncio.to_thread(optimize_database)
+    await edit("✅ تم تحسين قاعدة البيانات بنجاح")
+
+
+async def _cb_clean_db(update: Update, context: ContextTypes.DEFAULT_TYPE, query, data):
+    """🧹 تأكيد تنظيف قاعدة البيانات"""
+    await query.edit_message_text("⚠️ *تنبيه:*\n\n"
+                                 "سيتم تنظيف قاعدة البيانات من التكرارات\n"
+                                 "وسيتم إنشاء نسخة احتياطية تلقائياً\n\n"
+                                 "هل أنت متأكد؟",
+                                 reply_markup=InlineKeyboardMarkup([
+                                     [InlineKeyboardButton("✅ نعم، تابع", callback_data="confirm_clean_db")],
+                                     [InlineKeyboardButton("❌ لا، إلغاء", callback_data="admin_panel")]
+                                 ]),
+                                 parse_mode="Markdown")
+
+
+async def _cb_confirm_clean_db(update: Update, context: ContextTypes.DEFAULT_TYPE, query, data):
+    """🧹 تنظيف قاعدة البيانات"""
+    edit = query.edit_message_text
+    await edit("⏳ جاري التنظيف مع النسخ الاحتياطي...")
+    success = await asyncio.to_thread(clean_database)
+    _invalidate_stats_cache()
+
+    if success:
+        await edit("✅ تم تنظيف قاعدة البيانات بنجاح")
     else:
+        await edit("❌ فشل تنظيف قاعدة البيانات")
+
+
+async def _cb_file_stats(update: Update, context: ContextTypes.DEFAULT_TYPE, query, data):
+    """📂 إحصائيات معالجة الملفات"""
+    file_stats = await _cached_stats(get_file_processing_stats)
+
+    parts = [
+        "📂 *إحصائيات معالجة الملفات*\n\n",
+        f"• الملفات في الكاش: {file_stats['cache_size']}\n",
+        f"• الروابط المستخرجة: {format_number(file_stats['total_links_extracted'])}\n\n",
+    ]
+
+    if file_stats.get('file_types'):
+        parts.append("*حسب نوع الملف:*\n")
+        for file_type, count in file_stats['file_types'].items():
+            parts.append(f"• {file_type.upper()}: {count}\n")
+
+    await query.edit_message_text("".join(parts), parse_mode="Markdown")
+
+
+async def _cb_test_all_sessions(update: Update, context: ContextTypes.DEFAULT_TYPE, query, data):
+    """🧪 اختبار جميع الجلسات"""
+    edit = query.edit_message_text
+    await edit("⏳ جاري اختبار جميع الجلسات...")
+    results = await check_all_sessions_health()
+
+    # عد الحالات وجمع المعطلة في مسار واحد على النتائج
+    counts = Counter(r['status'] for r in results)
+    healthy = counts['healthy']
+    unhealthy = counts['unhealthy']
+    bad = [r for r in results if r['status'] == 'unhealthy']
+
+    parts = [
+        f"🧪 *نتائج اختبار الجلسات*\n\n",
+        f"✅ النشطة: {healthy}\n",
+        f"❌ المعطلة: {unhealthy}\n",
+        f"📊 المجموع: {len(results)}\n\n",
+    ]
+
+    if bad:
+        parts.append("*الجلسات المعطلة:*\n")
+        for result in bad:
+            parts.append(f"• {result['name']}: {result.get('error', 'خطأ غير معروف')}\n")
+
+    message = "".join(parts)
+    await edit(message[:4000], parse_mode="Markdown")
+
+
+async def _cb_delete_all_sessions(update: Update, context: ContextTypes.DEFAULT_TYPE, query, data):
+    """🗑 تأكيد حذف جميع الجلسات"""
+    await query.edit_message_text("⚠️ *تحذير شديد:*\n\n"
+                                 "سيتم حذف جميع الحسابات المضافة!\n"
+                                 "لا يمكن التراجع عن هذا الإجراء\n\n"
+                                 "هل أنت متأكد تماماً؟",
+                                 reply_markup=InlineKeyboardMarkup([
+                                     [InlineKeyboardButton("🔥 نعم، احذف الكل", callback_data="confirm_delete_all")],
+                                     [InlineKeyboardButton("❌ إلغاء", callback_data="admin_panel")]
+                                 ]),
+                                 parse_mode="Markdown")
+
+
+async def _cb_confirm_delete_all(update: Update, context: ContextTypes.DEFAULT_TYPE, query, data):
+    """🗑 حذف جميع الجلسات"""
+    deleted_count = delete_all_sessions()
+    await query.edit_message_text(f"✅ تم حذف جميع الحسابات ({deleted_count})")
+
+
+async def _cb_back_to_main(update: Update, context: ContextTypes.DEFAULT_TYPE, query, data):
+    """↩️ العودة للقائمة الرئيسية"""
+    await start(update, context)
+
+
+# جدول التوجيه: بحث hash واحد بدل سلسلة مقارنات elif طويلة
+CB_HANDLERS = {
+    "add_account": _cb_add_account,
+    "list_accounts": _cb_list_accounts,
+    "start_collect": _cb_start_collect,
+    "stop_collect": _cb_stop_collect,
+    "view_links": _cb_view_links,
+    "stats_summary": _cb_stats_summary,
+    "telegram_stats": _cb_telegram_stats,
+    "whatsapp_stats": _cb_whatsapp_stats,
+    "choose:telegram": _cb_choose_telegram,
+    "choose:whatsapp": _cb_choose_whatsapp,
+    "export_links": _cb_export_links,
+    "admin_panel": _cb_admin_panel,
+    "detailed_stats": _cb_detailed_stats,
+    "backup_menu": _cb_backup_menu,
+    "create_backup": _cb_create_backup,
+    "list_backups": _cb_list_backups,
+    "db_stats": _cb_db_stats,
+    "optimize_db": _cb_optimize_db,
+    "clean_db": _cb_clean_db,
+    "confirm_clean_db": _cb_confirm_clean_db,
+    "file_stats": _cb_file_stats,
+    "test_all_sessions": _cb_test_all_sessions,
+    "delete_all_sessions": _cb_delete_all_sessions,
+    "confirm_delete_all": _cb_confirm_delete_all,
+    "back_to_main": _cb_back_to_main,
+}
+
+# الأوامر ذات البادئة (مثل links:platform:type:page)
+CB_PREFIX_HANDLERS = {
+    "delete_account": _cb_delete_account,
+    "test_session": _cb_test_session,
+    "links": _cb_links,
+    "export": _cb_export,
+    "export_telegram": _cb_export_telegram,
+}
+
+
+async def callbacks(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """معالجة Callback Queries عبر جدول التوجيه"""
+    query = update.callback_query
+    user_id = update.effective_user.id
+    data = query.data
+
+    if not is_admin(user_id) and data in ADMIN_ONLY_ACTIONS:
+        return await query.answer("⛔ هذا الأمر للأدمن فقط!", show_alert=True)
+
+    await query.answer()
+
+    handler = CB_HANDLERS.get(data)
+    if handler is None:
+        handler = CB_PREFIX_HANDLERS.get(data.partition(":")[0])
+
+    if handler is None:
         await query.edit_message_text("❌ أمر غير معروف")
+        return
+
+    await handler(update, context, query, data)
 
 
 # ======================
@@ -767,25 +988,26 @@ async def callbacks(update: Update, context: ContextTypes.DEFAULT_TYPE):
 async def messages(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """معالجة الرسائل النصية"""
     user_id = update.effective_user.id
+    reply = update.message.reply_text
     
     if context.user_data.get("awaiting_session"):
         try:
             session_text = update.message.text.strip()
             
             # التحقق من أن النص يبدو كـ session string
-            if len(session_text) < 100 or ":" not in session_text:
-                await update.message.reply_text("❌ هذا لا يبدو كـ Session String صالح")
+            if not SESSION_RE.match(session_text):
+                await reply("❌ هذا لا يبدو كـ Session String صالح")
                 return
             
-            await update.message.reply_text("⏳ جاري التحقق من الحساب...")
+            await reply("⏳ جاري التحقق من الحساب...")
             await add_session(session_text)
-            await update.message.reply_text("✅ تم إضافة الحساب بنجاح!")
+            await reply("✅ تم إضافة الحساب بنجاح!")
             
         except ValueError as e:
-            await update.message.reply_text(f"❌ {str(e)}")
+            await reply(f"❌ {str(e)}")
         except Exception as e:
-            logger.error(f"Error adding session: {e}")
-            await update.message.reply_text("❌ حدث خطأ غير متوقع. حاول مرة أخرى.")
+            logger.error("Error adding session: %s", e)
+            await reply("❌ حدث خطأ غير متوقع. حاول مرة أخرى.")
         finally:
             context.user_data["awaiting_session"] = False
     
@@ -794,32 +1016,35 @@ async def messages(update: Update, context: ContextTypes.DEFAULT_TYPE):
         if is_admin(user_id) and update.message.document:
             file = update.message.document
             if file.file_name and file.file_name.endswith('.db'):
-                await update.message.reply_text("⏳ جاري استعادة النسخة الاحتياطية...")
+                await reply("⏳ جاري استعادة النسخة الاحتياطية...")
                 
-                # تحميل الملف
-                file_path = f"temp_backup_{file.file_name}"
+                # التحميل إلى ملف مؤقت على نفس نظام ملفات القاعدة
+                db_dir = os.path.dirname(DATABASE_PATH) or "."
+                fd, file_path = tempfile.mkstemp(suffix=".db", dir=db_dir)
+                os.close(fd)
                 file_obj = await file.get_file()
                 await file_obj.download_to_drive(file_path)
-                
-                # استعادة النسخة
-                success = restore_backup(file_path)
-                
-                # حذف الملف المؤقت
-                try:
-                    os.remove(file_path)
-                except:
-                    pass
+
+                # استعادة النسخة بإعادة تسمية ذرية بدل نسخة ثانية كاملة
+                success = await asyncio.to_thread(restore_backup, file_path, True)
+                _invalidate_stats_cache()
+
+                # حذف الملف المؤقت إذا بقي بعد فشل الاستعادة
+                if os.path.exists(file_path):
+                    try:
+                        os.remove(file_path)
+                    except:
+                        pass
                 
                 if success:
-                    await update.message.reply_text("✅ تم استعادة النسخة الاحتياطية بنجاح")
+                    await reply("✅ تم استعادة النسخة الاحتياطية بنجاح")
                 else:
-                    await update.message.reply_text("❌ فشل استعادة النسخة الاحتياطية")
+                    await reply("❌ فشل استعادة النسخة الاحتياطية")
             else:
-                await update.message.reply_text("❌ يرجى إرسال ملف قاعدة بيانات (.db)")
+                await reply("❌ يرجى إرسال ملف قاعدة بيانات (.db)")
         else:
-            await update.message.reply_text(
-                "📝 أرسل Session String لإضافة حساب جديد\n"
-                "أو استخدم الأزرار أدناه:",
+            await reply(
+                FALLBACK_PROMPT,
                 reply_markup=main_keyboard(user_id)
             )
 
@@ -830,7 +1055,7 @@ async def messages(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 async def error_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """معالجة الأخطاء"""
-    logger.error(f"Update {update} caused error {context.error}")
+    logger.error("Update %s caused error %s", update, context.error)
     
     if update and update.effective_message:
         try:
@@ -847,6 +1072,13 @@ async def error_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 def main():
     """الدالة الرئيسية"""
+    # تهيئة اللوج عند التشغيل فقط — مستوى WARNING افتراضياً
+    # لأن تنسيق asctime لكل سطر INFO مكلف أثناء الجمع المكثف
+    logging.basicConfig(
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+        level=getattr(logging, os.getenv("LOG_LEVEL", "WARNING").upper(), logging.WARNING)
+    )
+
     # تهيئة قاعدة البيانات
     init_db()
     
@@ -857,7 +1089,18 @@ def main():
     app.add_handler(CommandHandler("start", start))
     app.add_handler(CommandHandler("stats", stats))
     app.add_handler(CommandHandler("help", help_command))
-    app.add_handler(CallbackQueryHandler(callbacks))
+
+    # تسجيل الأوامر بأنماط regex مترجمة مسبقاً — المطابقة تتم داخل PTB
+    # بدل فحص خطي داخل بايثون لكل callback
+    exact_pattern = re.compile(
+        "^(?:" + "|".join(re.escape(k) for k in CB_HANDLERS) + ")$"
+    )
+    prefix_pattern = re.compile(
+        "^(?:" + "|".join(re.escape(k) for k in CB_PREFIX_HANDLERS) + "):"
+    )
+    app.add_handler(CallbackQueryHandler(callbacks, pattern=exact_pattern))
+    app.add_handler(CallbackQueryHandler(callbacks, pattern=prefix_pattern))
+    app.add_handler(CallbackQueryHandler(callbacks))  # الأوامر غير المعروفة
     app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, messages))
     app.add_handler(MessageHandler(filters.Document.ALL, messages))
     
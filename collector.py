@@ -1,15 +1,18 @@
 import asyncio
+import hashlib
 import logging
+import math
+from dataclasses import dataclass, field
 from datetime import datetime, timedelta
-from typing import List, Optional, Tuple
+from typing import Iterable, List, Optional
 
 from telethon import TelegramClient, events
 from telethon.sessions import StringSession
-from telethon.tl.types import Message, MessageReplies
+from telethon.tl.types import Channel, Chat, Message
 
 from config import API_ID, API_HASH
 from session_manager import get_active_sessions
-from database import save_link
+from database import save_links
 from link_utils import (
     extract_links_from_message,
     filter_and_classify_link,
@@ -17,6 +20,7 @@ from link_utils import (
     is_valid_telegram_link  # إضافة هذا الاستيراد
 )
 from file_extractors import extract_links_from_file
+from comment_extractor import extract_comments_links
 
 # ======================
 # Logging
@@ -28,17 +32,68 @@ logger = logging.getLogger(__name__)
 # Global State
 # ======================
 
-_clients: List[TelegramClient] = []
-_collecting: bool = False
-_stop_event = asyncio.Event()
-_processed_files = set()  # لتجنب معالجة نفس الملف مرتين
+class _BloomFilter:
+    """
+    مرشّح بلوم بسيط بذاكرة ثابتة
+    بديل عن set غير محدود النمو لتتبع الملفات المعالجة
+    الإيجابيات الكاذبة تعني فقط تخطي ملف سبق رؤيته — مقبول
+    """
+
+    def __init__(self, capacity: int, error_rate: float):
+        bits = int(-capacity * math.log(error_rate) / (math.log(2) ** 2))
+        self._m = bits
+        self._k = max(1, round((bits / capacity) * math.log(2)))
+        self._bits = bytearray((bits + 7) // 8)
+
+    def _indexes(self, key: bytes):
+        digest = hashlib.blake2b(key, digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        m = self._m
+        for i in range(self._k):
+            yield (h1 + i * h2) % m
+
+    def __contains__(self, key: bytes) -> bool:
+        bits = self._bits
+        return all(bits[i >> 3] & (1 << (i & 7)) for i in self._indexes(key))
+
+    def add(self, key: bytes):
+        bits = self._bits
+        for i in self._indexes(key):
+            bits[i >> 3] |= 1 << (i & 7)
+
+    def clear(self):
+        self._bits = bytearray(len(self._bits))
+
+
+@dataclass(slots=True)
+class CollectorState:
+    """
+    حالة الجمع المشتركة بين كل المهام
+    slots تجعل قراءة الحقول أرخص من بحث قاموس الوحدة
+    في فحص collecting الذي يجري عند كل رسالة
+    """
+    collecting: bool = False
+    stop_event: asyncio.Event = field(default_factory=asyncio.Event)
+    clients: List[TelegramClient] = field(default_factory=list)
+    # لتجنب معالجة نفس الملف مرتين
+    processed_files: _BloomFilter = field(
+        default_factory=lambda: _BloomFilter(capacity=3_000_000, error_rate=1e-6)
+    )
+    # حد الـ 60 يوم — يُحدَّث مرة لكل محادثة
+    wa_cutoff: datetime = field(
+        default_factory=lambda: datetime.now() - timedelta(days=60)
+    )
+
+
+_state = CollectorState()
 
 # ======================
 # Public API
 # ======================
 
 def is_collecting() -> bool:
-    return _collecting
+    return _state.collecting
 
 
 def stop_collection():
@@ -46,36 +101,47 @@ def stop_collection():
     يوقف الاستماع للرسائل الجديدة فقط
     لا يحذف أي بيانات
     """
-    global _collecting
-    _collecting = False
-    _stop_event.set()
+    _state.collecting = False
+    _state.stop_event.set()
     logger.info("Collection stopped (listening disabled).")
 
 
-async def start_collection():
+async def start_collection(started: Optional[asyncio.Event] = None):
     """
     تشغيل كل Sessions
     وبدء جمع التاريخ + الاستماع للجديد
+
+    started: حدث يتم ضبطه بعد اكتمال التهيئة
+    حتى يستطيع المستدعي انتظار البدء بدون انتظار الجمع كاملاً
     """
-    global _collecting, _clients, _processed_files
+    tasks = []
+    try:
+        if _state.collecting:
+            logger.info("Collection already running.")
+            return
 
-    if _collecting:
-        logger.info("Collection already running.")
-        return
+        sessions = get_active_sessions()
+        if not sessions:
+            logger.warning("No sessions found.")
+            return
 
-    sessions = get_active_sessions()
-    if not sessions:
-        logger.warning("No sessions found.")
-        return
+        _state.collecting = True
+        _state.stop_event = asyncio.Event()
+        _state.clients = []
+        _state.processed_files.clear()
+        _refresh_wa_cutoff()
 
-    _collecting = True
-    _stop_event.clear()
-    _clients = []
-    _processed_files.clear()
+        for session in sessions:
+            tasks.append(run_client(session))
 
-    tasks = []
-    for session in sessions:
-        tasks.append(run_client(session))
+    finally:
+        # يُضبط دائماً — حتى لو فشلت التهيئة بخطأ —
+        # وإلا علّق المستدعي على started.wait() إلى الأبد
+        if started:
+            started.set()
+
+    if not tasks:
+        return
 
     # تشغيل كل الحسابات معاً
     await asyncio.gather(*tasks)
@@ -103,9 +169,9 @@ async def run_client(session_data: dict):
     )
 
     await client.connect()
-    _clients.append(client)
+    _state.clients.append(client)
 
-    logger.info(f"Client started: {account_name}")
+    logger.info("Client started: %s", account_name)
 
     # ======================
     # Listener (New Messages)
@@ -113,7 +179,7 @@ async def run_client(session_data: dict):
 
     @client.on(events.NewMessage)
     async def new_message_handler(event):
-        if not _collecting:
+        if not _state.collecting:
             return
 
         await process_message(
@@ -129,16 +195,21 @@ async def run_client(session_data: dict):
     await collect_old_messages(client, account_name)
 
     # بعد الانتهاء من التاريخ نبقى فقط على الاستماع
-    await _stop_event.wait()
+    await _state.stop_event.wait()
 
     await client.disconnect()
-    logger.info(f"Client stopped: {account_name}")
+    logger.info("Client stopped: %s", account_name)
 
 
 # ======================
 # Collect History
 # ======================
 
+# عدد المحادثات التي تُقرأ بالتوازي لكل حساب
+# محدود حتى لا نصطدم بحدود FloodWait لدى تليجرام
+DIALOG_CONCURRENCY = 8
+
+
 async def collect_old_messages(client: TelegramClient, account_name: str):
     """
     المرور على:
@@ -146,80 +217,72 @@ async def collect_old_messages(client: TelegramClient, account_name: str):
     - كل الجروبات
     - كل المحادثات الخاصة
     وقراءة كل الرسائل من أول رسالة
+
+    المحادثات تُقرأ بالتوازي (بحد أقصى DIALOG_CONCURRENCY)
+    لأن العامل المحدد هو زمن الشبكة وليس المعالج
+    """
+    dialogs = [dialog async for dialog in client.iter_dialogs()]
+
+    sem = asyncio.Semaphore(DIALOG_CONCURRENCY)
+    await asyncio.gather(*(
+        _sweep_dialog(client, dialog, sem, account_name)
+        for dialog in dialogs
+    ))
+
+
+async def _sweep_dialog(client: TelegramClient, dialog, sem: asyncio.Semaphore, account_name: str):
+    """
+    قراءة محادثة واحدة كاملة ضمن حد التوازي
     """
-    async for dialog in client.iter_dialogs():
+    async with sem:
         entity = dialog.entity
+        _refresh_wa_cutoff()
 
         try:
-            # قراءة الرسائل بشكل عكسي (من الأقدم إلى الأحدث)
-            async for message in client.iter_messages(entity, reverse=True):
-                if not _collecting:
-                    return
-
-                await process_message(
-                    message=message,
-                    account_name=account_name,
-                    client=client
+            # قراءة الرسائل على دفعات بشكل عكسي (من الأقدم إلى الأحدث)
+            # الترقيم اليدوي يجعل الإيقاف نافذاً عند حدود الدفعة
+            # بدل انتظار ما جلبه iter_messages مسبقاً عبر الشبكة
+            offset_id = 0
+            while _state.collecting:
+                batch = await client.get_messages(
+                    entity,
+                    limit=100,
+                    offset_id=offset_id,
+                    reverse=True
                 )
+                if not batch:
+                    break
+
+                for message in batch:
+                    if not _state.collecting:
+                        return
+
+                    await process_message(
+                        message=message,
+                        account_name=account_name,
+                        client=client
+                    )
+
+                offset_id = batch[-1].id
 
         except Exception as e:
-            logger.error(f"Error reading dialog {dialog.name}: {e}")
+            logger.error("Error reading dialog %s: %s", dialog.name, e)
 
 
 # ======================
 # WhatsApp Time Filter
 # ======================
 
-def is_within_last_60_days(message_date: datetime) -> bool:
-    """تحقق إذا كانت الرسالة ضمن آخر 60 يومًا"""
-    cutoff_date = datetime.now() - timedelta(days=60)
-    return message_date > cutoff_date
+# حد الـ 60 يوم يُحسب مرة عند بدء الجمع ويُحدَّث مرة لكل محادثة
+# بدل إنشاء كائني datetime جديدين عند كل رابط
 
+def _refresh_wa_cutoff():
+    _state.wa_cutoff = datetime.now() - timedelta(days=60)
 
-# ======================
-# Comment Extractor
-# ======================
 
-async def extract_comment_links(client: TelegramClient, message: Message, account_name: str) -> List[str]:
-    """
-    استخراج الروابط من التعليقات على الرسالة
-    """
-    links = []
-    
-    try:
-        # التحقق إذا كانت الرسالة تحتوي على تعليقات
-        if hasattr(message, 'replies') and isinstance(message.replies, MessageReplies):
-            if message.replies.comments and message.replies.replies > 0:
-                # جلب التعليقات
-                async for reply in client.iter_messages(
-                    message.chat_id,
-                    reply_to=message.id,
-                    limit=50  # حد أقصى 50 تعليق
-                ):
-                    # استخراج الروابط من كل تعليق
-                    reply_links = extract_links_from_message(reply)
-                    
-                    # تصفية الروابط مباشرة
-                    for link in reply_links:
-                        classified = filter_and_classify_link(link)
-                        if classified:
-                            platform, _ = classified
-                            # تطبيق الفلاتر
-                            if platform == 'whatsapp':
-                                if not is_within_last_60_days(message.date):
-                                    continue
-                            elif platform == 'telegram':
-                                if not is_valid_telegram_link(link):
-                                    continue
-                            else:
-                                continue  # تجاهل المنصات الأخرى
-                            
-                            links.append(link)
-                    
-    except Exception as e:
-        logger.error(f"Error extracting comments: {e}")
-    
-    return links
+def is_within_last_60_days(message_date: datetime) -> bool:
+    """تحقق إذا كانت الرسالة ضمن آخر 60 يومًا"""
+    return message_date > _state.wa_cutoff
 
 
 # ======================
@@ -235,18 +298,19 @@ async def process_files(client: TelegramClient, message: Message, account_name:
         return
     
     try:
-        # إنشاء معرف فريد للملف (اسم الملف + حجمه)
-        file_name = getattr(message.file, 'name', 'unknown')
-        file_size = getattr(message.file, 'size', 0)
-        file_id = f"{file_name}_{file_size}"
+        # معرف المستند من تليجرام ثابت عبر المحادثات، بخلاف الاسم/الحجم
+        document = getattr(message, 'document', None)
+        if document is None:
+            return
+        file_key = document.id.to_bytes(8, "little", signed=True)
         
         # التحقق إذا كان الملف قد تم معالجته مسبقاً
-        if file_id in _processed_files:
-            logger.info(f"File already processed: {file_name}")
+        if file_key in _state.processed_files:
+            logger.debug("File already processed: %s", document.id)
             return
         
         # إضافة الملف إلى القائمة المعالجة
-        _processed_files.add(file_id)
+        _state.processed_files.add(file_key)
         
         # استخراج الروابط من الملف
         file_links = await extract_links_from_file(
@@ -254,49 +318,26 @@ async def process_files(client: TelegramClient, message: Message, account_name:
             message=message
         )
         
-        # معالجة الروابط المستخرجة
+        # معالجة الروابط المستخرجة وتجميعها في دفعة واحدة
+        rows = []
+        seen = set()
+        chat_id = str(message.chat_id)
+
         for link in file_links:
-            # تصنيف الرابط
-            classified = filter_and_classify_link(link)
-            if not classified:
+            # إزالة التكرار داخل الملف قبل الوصول لقاعدة البيانات
+            if link in seen:
                 continue
-            
-            platform, link_chat_type = classified
-            
-            # تطبيق الفلاتر الخاصة بنا
-            if platform == 'whatsapp':
-                if not is_within_last_60_days(message_date):
-                    continue
-                save_link(
-                    url=link,
-                    platform=platform,
-                    source_account=account_name,
-                    chat_type=link_chat_type,
-                    chat_id=str(message.chat_id),
-                    message_date=message_date,
-                    source_type='file'
-                )
-                
-            elif platform == 'telegram':
-                if is_valid_telegram_link(link):
-                    # تحديد نوع رابط تليجرام
-                    if link.startswith('t.me/+'):
-                        telegram_type = 'invite_with_plus'
-                    else:
-                        telegram_type = 'invite_without_plus'
-                    
-                    save_link(
-                        url=link,
-                        platform=f'telegram_{telegram_type}',
-                        source_account=account_name,
-                        chat_type=link_chat_type,
-                        chat_id=str(message.chat_id),
-                        message_date=message_date,
-                        source_type='file'
-                    )
-                    
+            seen.add(link)
+
+            row = _build_link_row(link, account_name, chat_id, message_date, 'file')
+            if row:
+                rows.append(row)
+
+        if rows:
+            save_links(rows)
+
     except Exception as e:
-        logger.error(f"File processing error: {e}")
+        logger.error("File processing error: %s", e)
 
 
 # ======================
@@ -335,7 +376,7 @@ async def process_message(
     # ======================
     # 3️⃣ روابط التعليقات
     # ======================
-    comment_links = await extract_comment_links(client, message, account_name)
+    comment_links = await extract_comments_links(client, message, account_name, message.date)
     await process_links_list(comment_links, message, account_name, 'comment')
 
     # ======================
@@ -348,49 +389,59 @@ async def process_message(
 # Links List Processing
 # ======================
 
-async def process_links_list(links: List[str], message: Message, account_name: str, source_type: str):
+def _build_link_row(link: str, account_name: str, chat_id: str, message_date: datetime, source_type: str) -> Optional[tuple]:
+    """
+    تصنيف رابط واحد وتطبيق الفلاتر
+    يعيد صف الحفظ أو None إذا كان الرابط مرفوضاً
+
+    المنطق المشترك بين روابط الرسائل وروابط الملفات
+    """
+    classified = filter_and_classify_link(link)
+    if not classified:
+        return None
+
+    platform, link_chat_type = classified
+
+    # تطبيق الفلاتر الخاصة بنا
+    if platform == 'whatsapp':
+        if not is_within_last_60_days(message_date):
+            return None
+    elif platform.startswith('telegram_'):
+        # المصنّف يعيد النوع كاملاً (telegram_invite_with_plus / _without_plus)
+        if not is_valid_telegram_link(link):
+            return None
+    else:
+        return None
+
+    return (
+        link, platform, account_name,
+        link_chat_type, chat_id, message_date, source_type
+    )
+
+
+async def process_links_list(links: Iterable[str], message: Message, account_name: str, source_type: str):
     """
-    معالجة قائمة من الروابط
+    معالجة روابط رسالة واحدة وحفظها دفعة واحدة
+    يقبل أي iterable (المستخرجات مولّدات — لا قوائم وسيطة)
     """
+    rows = []
+    seen = set()
+    message_date = message.date
+    chat_id = str(message.chat_id)
+
     for link in links:
-        # تصنيف الرابط
-        classified = filter_and_classify_link(link)
-        if not classified:
+        # إزالة التكرار داخل الرسالة قبل الوصول لقاعدة البيانات
+        if link in seen:
             continue
-        
-        platform, link_chat_type = classified
-        
-        # تطبيق الفلاتر الخاصة بنا
-        if platform == 'whatsapp':
-            if not is_within_last_60_days(message.date):
-                continue
-            save_link(
-                url=link,
-                platform=platform,
-                source_account=account_name,
-                chat_type=link_chat_type,
-                chat_id=str(message.chat_id),
-                message_date=message.date,
-                source_type=source_type
-            )
-            
-        elif platform == 'telegram':
-            if is_valid_telegram_link(link):
-                # تحديد نوع رابط تليجرام
-                if link.startswith('t.me/+'):
-                    telegram_type = 'invite_with_plus'
-                else:
-                    telegram_type = 'invite_without_plus'
-                
-                save_link(
-                    url=link,
-                    platform=f'telegram_{telegram_type}',
-                    source_account=account_name,
-                    chat_type=link_chat_type,
-                    chat_id=str(message.chat_id),
-                    message_date=message.date,
-                    source_type=source_type
-                )
+        seen.add(link)
+
+        row = _build_link_row(link, account_name, chat_id, message_date, source_type)
+        if row:
+            rows.append(row)
+
+    # معاملة واحدة لكل الرسالة بدل commit لكل رابط
+    if rows:
+        save_links(rows)
 
 
 # ======================
@@ -402,10 +453,8 @@ def get_chat_type(entity) -> str:
     تحديد نوع المحادثة:
     channel / group / private
     """
-    cls = entity.__class__.__name__.lower()
-
-    if "channel" in cls:
+    if isinstance(entity, Channel):
         return "channel"
-    if "chat" in cls:
+    if isinstance(entity, Chat):
         return "group"
     return "private"
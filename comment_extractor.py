@@ -1,14 +1,30 @@
 import logging
+import re
 from typing import List, Set
 from datetime import datetime, timedelta
 
 from telethon import TelegramClient
 from telethon.tl.types import Message, MessageReplies
 
-from link_utils import extract_links_from_message, is_valid_link_for_extraction
+from link_utils import (
+    extract_links_from_message,
+    is_valid_link_for_extraction,
+    is_valid_telegram_link,
+)
 
 logger = logging.getLogger(__name__)
 
+# نافذة واتساب الثابتة — تُبنى مرة واحدة بدل كل استدعاء
+_WA_WINDOW = timedelta(days=60)
+
+# ميزانية قصوى لجلب التعليقات والردود لكل رسالة أصلية
+# تمنع التوسع التربيعي (100 تعليق × 50 رد)
+MAX_COMMENT_FETCHES = 500
+
+# أنماط مضغوطة لفحص المضيف بدل بناء نسخة lowercase لكل فحص
+WA_HOST_REGEX = re.compile(r"(?i)(whatsapp\.com|wa\.me)")
+TG_HOST_REGEX = re.compile(r"(?i)(t\.me|telegram\.me)")
+
 
 async def extract_comments_links(
     client: TelegramClient,
@@ -37,16 +53,17 @@ async def extract_comments_links(
             
             # التحقق من وجود تعليقات
             if replies_info.comments and replies_info.replies > 0:
-                logger.info(f"Found {replies_info.replies} comments on message {message.id} in chat {message.chat_id}")
+                logger.debug("Found %s comments on message %s in chat %s", replies_info.replies, message.id, message.chat_id)
                 
                 # الحصول على معرف الدردشة للتعليقات
                 comments_peer = replies_info.comments_peer
                 if not comments_peer:
-                    logger.debug(f"No comments peer found for message {message.id}")
+                    logger.debug("No comments peer found for message %s", message.id)
                     return list(links)
                 
-                # جلب جميع التعليقات
+                # جلب جميع التعليقات ضمن ميزانية محددة
                 comment_count = 0
+                fetches = 0
                 try:
                     async for reply in client.iter_messages(
                         comments_peer,
@@ -54,6 +71,9 @@ async def extract_comments_links(
                         limit=100  # حد أقصى 100 تعليق لتجنب الحمل الزائد
                     ):
                         comment_count += 1
+                        fetches += 1
+                        if fetches > MAX_COMMENT_FETCHES:
+                            break
                         
                         # استخراج الروابط من التعليق
                         reply_links = extract_links_from_message(reply)
@@ -67,23 +87,40 @@ async def extract_comments_links(
                         if hasattr(reply, 'replies') and reply.replies:
                             if hasattr(reply.replies, 'replies') and reply.replies.replies > 0:
                                 # استخراج الروابط من الردود على التعليق
+                                # مع خروج مبكر إذا توقفت الردود عن إضافة روابط جديدة
+                                links_before = len(links)
+                                stale = 0
                                 async for sub_reply in client.iter_messages(
                                     comments_peer,
                                     reply_to=reply.id,
                                     limit=50  # حد أقصى 50 رد لكل تعليق
                                 ):
+                                    fetches += 1
                                     sub_links = extract_links_from_message(sub_reply)
                                     for link in sub_links:
                                         if is_valid_link_for_extraction(link):
                                             links.add(link.strip())
+
+                                    # الميزانية تُفحص بعد كل جلب —
+                                    # حتى الردود المنتجة لا تتجاوزها
+                                    if fetches > MAX_COMMENT_FETCHES:
+                                        break
+
+                                    if len(links) == links_before:
+                                        stale += 1
+                                        if stale >= 10:
+                                            break
+                                    else:
+                                        links_before = len(links)
+                                        stale = 0
                     
-                    logger.info(f"Processed {comment_count} comments, found {len(links)} links")
+                    logger.debug("Processed %s comments, found %s links", comment_count, len(links))
                     
                 except Exception as e:
-                    logger.error(f"Error fetching comments for message {message.id}: {e}")
+                    logger.error("Error fetching comments for message %s: %s", message.id, e)
         
     except Exception as e:
-        logger.error(f"Error extracting comments from message {message.id}: {e}")
+        logger.error("Error extracting comments from message %s: %s", message.id, e)
     
     return list(links)
 
@@ -107,7 +144,7 @@ async def extract_thread_links(
     try:
         # التحقق إذا كانت الرسالة جزء من thread
         if hasattr(message, 'grouped_id') and message.grouped_id:
-            logger.info(f"Message {message.id} is part of thread {message.grouped_id}")
+            logger.debug("Message %s is part of thread %s", message.id, message.grouped_id)
             
             # جلب باقي رسائل الـ thread
             async for thread_msg in client.iter_messages(
@@ -122,7 +159,7 @@ async def extract_thread_links(
                             links.add(link.strip())
     
     except Exception as e:
-        logger.error(f"Error extracting thread links: {e}")
+        logger.error("Error extracting thread links: %s", e)
     
     return list(links)
 
@@ -143,8 +180,7 @@ def is_recent_comment(comment_date: datetime, original_date: datetime) -> bool:
         return False
     
     # للواتساب: فقط التعليقات ضمن 60 يوم
-    cutoff_date = datetime.now() - timedelta(days=60)
-    return comment_date > cutoff_date
+    return comment_date > datetime.now() - _WA_WINDOW
 
 
 async def process_comments_for_links(
@@ -172,13 +208,12 @@ async def process_comments_for_links(
     
     for link in all_links:
         # تطبيق نفس الفلاتر من collector
-        if "t.me" in link.lower() or "telegram.me" in link.lower():
+        if TG_HOST_REGEX.search(link):
             # رابط تليجرام
-            from link_utils import is_valid_telegram_link
             if is_valid_telegram_link(link):
                 filtered_links.append(link)
         
-        elif "whatsapp.com" in link.lower() or "wa.me" in link.lower():
+        elif WA_HOST_REGEX.search(link):
             # رابط واتساب - نتحقق من التاريخ
             # نحتاج للتحقق من تاريخ التعليق نفسه
             # سنفترض أن تعليقات واتساب كلها حديثة إذا كانت الرسالة حديثة
@@ -208,5 +243,5 @@ async def get_all_comments_links(
     try:
         return await extract_comments_links(client, message, account_name, message.date)
     except Exception as e:
-        logger.error(f"Error in get_all_comments_links: {e}")
+        logger.error("Error in get_all_comments_links: %s", e)
         return []
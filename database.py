@@ -1,7 +1,12 @@
 import sqlite3
 import os
 import shutil
+import tempfile
+import atexit
+import functools
 import logging
+import threading
+import time
 from datetime import datetime, timedelta  # التعديل هنا!
 from typing import Dict, List, Tuple, Optional
 from config import DATABASE_PATH
@@ -24,28 +29,121 @@ BACKUP_RETENTION_DAYS = 30  # الاحتفاظ بالنسخ الاحتياطي 
 # Connection
 # ======================
 
+_tls = threading.local()
+
+# جيل الاتصالات: يرتفع عند استبدال ملف القاعدة (الاستعادة)
+# فتعيد كل الخيوط — وليس خيط الاستعادة فقط — فتح اتصالاتها
+# على الملف الجديد بدل الكتابة على inode المحذوف
+_conn_generation = 0
+
+# سجل بكل الاتصالات المفتوحة عبر الخيوط —
+# الاستعادة تغلقها كلها (check_same_thread=False يسمح بذلك)
+# لأن اتصالاً مفتوحاً ولو خاملاً يُبقي أقفال WAL على الملف القديم
+_all_conns = set()
+_conns_lock = threading.Lock()
+
+
 def get_connection():
     """
-    إنشاء اتصال بقاعدة البيانات
-    مع زيادة حجم الـ cache وتحسين الأداء
+    اتصال واحد مخزّن لكل خيط (thread-local)
+    إعادة الفتح عند كل استدعاء كانت تعيد تنفيذ كل الـ PRAGMAs
+    وتفقد دفء الـ page cache بين الاستدعاءات
     """
+    conn = getattr(_tls, "conn", None)
+    if conn is not None:
+        if getattr(_tls, "generation", -1) == _conn_generation:
+            return conn
+        # اتصال من جيل قديم — الملف استُبدل تحته
+        try:
+            conn.close()
+        except sqlite3.Error:
+            pass
+        _tls.conn = None
+
     conn = sqlite3.connect(
         DATABASE_PATH,
         check_same_thread=False,
         timeout=30  # زيادة مهلة الانتظار
     )
     
-    # تحسينات الأداء
+    # تحسينات الأداء (مرة واحدة لكل خيط)
     conn.execute("PRAGMA journal_mode = WAL")  # تحسين الأداء للقراءة/كتابة متزامنة
     conn.execute("PRAGMA synchronous = NORMAL")  # توازن بين الأمان والأداء
-    conn.execute(f"PRAGMA cache_size = {-50000}")  # 50MB cache
+    conn.execute("PRAGMA wal_autocheckpoint = 10000")  # checkpoint أقل تكراراً تحت الكتابة الكثيفة
+    conn.execute("PRAGMA cache_size = -65536")  # 64MB cache لإبقاء شجرة B في الذاكرة
     conn.execute("PRAGMA foreign_keys = ON")
     conn.execute("PRAGMA temp_store = MEMORY")
     conn.execute("PRAGMA mmap_size = 268435456")  # 256MB memory mapping
     
+    _tls.conn = conn
+    _tls.generation = _conn_generation
+    with _conns_lock:
+        _all_conns.add(conn)
     return conn
 
 
+def invalidate_connections():
+    """
+    إبطال وإغلاق الاتصالات المخزّنة في كل الخيوط
+    رفع رقم الجيل يجعل كل خيط يعيد الفتح عند الاستخدام التالي،
+    والإغلاق الفوري يحرر أقفال WAL قبل استبدال ملف القاعدة
+    """
+    global _conn_generation
+    _conn_generation += 1
+
+    with _conns_lock:
+        conns = list(_all_conns)
+        _all_conns.clear()
+
+    for conn in conns:
+        try:
+            conn.close()
+        except sqlite3.Error:
+            pass
+
+    _tls.conn = None
+
+
+def connection_generation() -> int:
+    """رقم الجيل الحالي — يرتفع عند كل استبدال لملف القاعدة"""
+    return _conn_generation
+
+
+def register_connection(conn):
+    """
+    تسجيل اتصال مفتوح خارج هذه الوحدة (مثل session_manager)
+    ليُغلق مع البقية في invalidate_connections عند الاستعادة —
+    الوحدتان تتشاركان نفس DATABASE_PATH ونفس ملف WAL
+    """
+    with _conns_lock:
+        _all_conns.add(conn)
+
+
+def unregister_connection(conn):
+    """إزالة اتصال من السجل قبل أن يغلقه صاحبه محلياً"""
+    with _conns_lock:
+        _all_conns.discard(conn)
+
+
+def close_connection():
+    """
+    إغلاق اتصال الخيط الحالي
+    مطلوب قبل استبدال ملف القاعدة (الاستعادة من نسخة احتياطية)
+    """
+    conn = getattr(_tls, "conn", None)
+    if conn is not None:
+        with _conns_lock:
+            _all_conns.discard(conn)
+        try:
+            conn.close()
+        except:
+            pass
+        _tls.conn = None
+
+
+atexit.register(close_connection)
+
+
 # ======================
 # Backup Functions
 # ======================
@@ -62,8 +160,14 @@ def create_backup():
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
         backup_file = os.path.join(BACKUP_DIR, f"links_backup_{timestamp}.db")
         
-        # نسخ الملف
-        shutil.copy2(DATABASE_PATH, backup_file)
+        # النسخ عبر واجهة backup الخاصة بـ SQLite:
+        # تنسخ الصفحات دون إيقاف الكتّاب وبلا خطر لقطة WAL ناقصة
+        src_conn = get_connection()
+        dst = sqlite3.connect(backup_file)
+        try:
+            src_conn.backup(dst, pages=1000)
+        finally:
+            dst.close()
         
         logger.info(f"Backup created: {backup_file}")
         
@@ -84,46 +188,67 @@ def cleanup_old_backups():
         if not os.path.exists(BACKUP_DIR):
             return
         
-        cutoff_date = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0) - timedelta(days=BACKUP_RETENTION_DAYS)
-        
-        for filename in os.listdir(BACKUP_DIR):
-            if filename.startswith("links_backup_") and filename.endswith(".db"):
-                # استخراج التاريخ من اسم الملف
+        cutoff_ts = (
+            datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+            - timedelta(days=BACKUP_RETENTION_DAYS)
+        ).timestamp()
+        
+        # scandir يعيد الحجم والتاريخ مع الإدخال نفسه — بلا stat إضافي
+        # والاعتماد على mtime يغني عن strptime لاسم الملف
+        with os.scandir(BACKUP_DIR) as entries:
+            for entry in entries:
+                if not (entry.name.startswith("links_backup_") and entry.name.endswith(".db")):
+                    continue
+                
                 try:
-                    date_str = filename.replace("links_backup_", "").replace(".db", "")
-                    file_date = datetime.strptime(date_str, "%Y%m%d_%H%M%S")
-                    
-                    if file_date < cutoff_date:
-                        file_path = os.path.join(BACKUP_DIR, filename)
-                        os.remove(file_path)
-                        logger.info(f"Deleted old backup: {filename}")
+                    if entry.stat().st_mtime < cutoff_ts:
+                        os.remove(entry.path)
+                        logger.info(f"Deleted old backup: {entry.name}")
                 except Exception as e:
-                    logger.warning(f"Could not parse backup file date {filename}: {e}")
+                    logger.warning(f"Could not remove backup {entry.name}: {e}")
                     
     except Exception as e:
         logger.error(f"Error cleaning up old backups: {e}")
 
 
-def restore_backup(backup_file: str) -> bool:
+def restore_backup(backup_file: str, move: bool = False) -> bool:
     """
     استعادة قاعدة البيانات من نسخة احتياطية
+
+    move=True يستبدل القاعدة بإعادة تسمية ذرية بدل نسخ الملف
+    (مناسب للملفات المؤقتة الموجودة على نفس نظام الملفات)
     """
     try:
         if not os.path.exists(backup_file):
             logger.error(f"Backup file not found: {backup_file}")
             return False
-        
-        # إغلاق أي اتصالات حالية
-        try:
-            conn = get_connection()
-            conn.close()
-        except:
-            pass
-        
-        # نسخ ملف النسخة الاحتياطية
-        shutil.copy2(backup_file, DATABASE_PATH)
-        
+
+        # إبطال اتصالات كل الخيوط قبل استبدال الملف —
+        # وإلا تبقى خيوط أخرى تكتب على الـ inode المحذوف
+        invalidate_connections()
+
+        # تفريغ WAL القاعدة القديمة قبل الاستبدال —
+        # وإلا أعاد SQLite تشغيل إطاراتها فوق القاعدة المستعادة
+        if os.path.exists(DATABASE_PATH):
+            try:
+                tmp_conn = sqlite3.connect(DATABASE_PATH, timeout=30)
+                tmp_conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+                tmp_conn.close()
+            except sqlite3.Error as e:
+                logger.warning(f"WAL checkpoint before restore failed: {e}")
+
+        if move:
+            os.replace(backup_file, DATABASE_PATH)
+        else:
+            # نسخ ملف النسخة الاحتياطية
+            shutil.copy2(backup_file, DATABASE_PATH)
+
+        # إعادة التهيئة: نسخة قديمة قد تسبق ترحيلات المخطط
+        # (جدول meta / عمود telegram_type) فتفشل الكتابات بعدها
+        init_db()
+
         logger.info(f"Database restored from backup: {backup_file}")
+        _bump_stats_version()
         return True
     except Exception as e:
         logger.error(f"Failed to restore backup: {e}")
@@ -140,23 +265,20 @@ def list_backups() -> List[Dict[str, str]]:
         if not os.path.exists(BACKUP_DIR):
             return backups
         
-        for filename in sorted(os.listdir(BACKUP_DIR), reverse=True):
-            if filename.startswith("links_backup_") and filename.endswith(".db"):
-                file_path = os.path.join(BACKUP_DIR, filename)
-                size = os.path.getsize(file_path)
-                size_mb = size / (1024 * 1024)
+        with os.scandir(BACKUP_DIR) as entries:
+            for entry in sorted(entries, key=lambda e: e.name, reverse=True):
+                if not (entry.name.startswith("links_backup_") and entry.name.endswith(".db")):
+                    continue
                 
-                # استخراج التاريخ
-                date_str = filename.replace("links_backup_", "").replace(".db", "")
-                try:
-                    file_date = datetime.strptime(date_str, "%Y%m%d_%H%M%S")
-                    formatted_date = file_date.strftime("%Y-%m-%d %H:%M:%S")
-                except:
-                    formatted_date = "Unknown"
+                # الحجم والتاريخ من stat المخزّن مع الإدخال — بلا syscall إضافي
+                st = entry.stat()
+                size = st.st_size
+                size_mb = size / (1024 * 1024)
+                formatted_date = datetime.fromtimestamp(st.st_mtime).strftime("%Y-%m-%d %H:%M:%S")
                 
                 backups.append({
-                    "filename": filename,
-                    "path": file_path,
+                    "filename": entry.name,
+                    "path": entry.path,
                     "date": formatted_date,
                     "size_mb": f"{size_mb:.2f}",
                     "size_bytes": size
@@ -195,9 +317,23 @@ def init_db():
                 chat_id TEXT,
                 message_date TEXT,
                 collected_date TEXT DEFAULT CURRENT_TIMESTAMP,
-                source_type TEXT  -- text, button, comment, file
+                source_type TEXT,  -- text, button, comment, file
+                telegram_type TEXT  -- invite_with_plus, invite_without_plus
+            )
+        """)
+        
+        # جدول meta: عدّاد صفوف مُصان يدوياً
+        # لأن COUNT(*) في SQLite مسح كامل للجدول
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS meta (
+                key TEXT PRIMARY KEY,
+                value INTEGER
             )
         """)
+        cur.execute("""
+            INSERT OR IGNORE INTO meta (key, value)
+            VALUES ('link_count', (SELECT COUNT(*) FROM links))
+        """)
         
         # جدول للإحصائيات اليومية
         cur.execute("""
@@ -209,19 +345,37 @@ def init_db():
             )
         """)
         
-        # جدول لأنواع روابط تليجرام
+        # ترحيل القواعد القديمة:
+        # telegram_type صار عموداً على links (مشتق من platform)
+        # بدل جدول ربط يكلف إدراجاً ثانياً و JOIN في كل استعلام
+        cur.execute("PRAGMA table_info(links)")
+        existing_cols = {row[1] for row in cur.fetchall()}
+        if 'telegram_type' not in existing_cols:
+            cur.execute("ALTER TABLE links ADD COLUMN telegram_type TEXT")
+            cur.execute("""
+                UPDATE links SET telegram_type = substr(platform, 10)
+                WHERE platform LIKE 'telegram_%'
+            """)
+        cur.execute("DROP TABLE IF EXISTS telegram_types")
+        
         cur.execute("""
-            CREATE TABLE IF NOT EXISTS telegram_types (
-                link_id INTEGER,
-                telegram_type TEXT,  -- invite_with_plus, invite_without_plus
-                FOREIGN KEY (link_id) REFERENCES links(id)
-            )
+            CREATE INDEX IF NOT EXISTS idx_links_tgtype
+            ON links (telegram_type) WHERE telegram_type IS NOT NULL
         """)
         
         # إنشاء الفهارس الأساسية
+        # فهرس مركب يغطي استعلام الترقيم (platform, chat_type + ترتيب بالتاريخ)
+        # ويغني عن فهرس (platform, chat_type) لأنه بادئة منه
+        cur.execute("DROP INDEX IF EXISTS idx_links_platform_type")
         cur.execute("""
-            CREATE INDEX IF NOT EXISTS idx_links_platform_type 
-            ON links (platform, chat_type)
+            CREATE INDEX IF NOT EXISTS idx_links_platform_chat_date 
+            ON links (platform, chat_type, message_date DESC)
+        """)
+        
+        # فهرس تعبيري يجعل شرط date(collected_date) = ? قابلاً للفهرسة
+        cur.execute("""
+            CREATE INDEX IF NOT EXISTS idx_links_collected_day 
+            ON links (date(collected_date))
         """)
         
         cur.execute("""
@@ -239,18 +393,20 @@ def init_db():
             ON links (platform, message_date DESC)
         """)
         
-        cur.execute("""
-            CREATE INDEX IF NOT EXISTS idx_links_url 
-            ON links (url)
-        """)
+        # ملاحظة: قيد UNIQUE على url ينشئ فهرساً ضمنياً
+        # لذا لا حاجة لفهرس idx_links_url منفصل — نحذفه إن وُجد
+        cur.execute("DROP INDEX IF EXISTS idx_links_url")
         
         cur.execute("""
             CREATE INDEX IF NOT EXISTS idx_links_collected_date 
             ON links (collected_date DESC)
         """)
         
+        # تحديث إحصائيات المخطط ليختار SQLite خططاً أفضل
+        cur.execute("ANALYZE")
+        cur.execute("PRAGMA optimize")
+        
         conn.commit()
-        conn.close()
         
         # إنشاء أول نسخة احتياطية
         create_backup()
@@ -275,7 +431,6 @@ def optimize_database():
         conn.execute("VACUUM")
         conn.execute("ANALYZE")
         conn.commit()
-        conn.close()
         
         logger.info("Database optimized successfully")
         
@@ -291,32 +446,33 @@ def update_daily_stats():
     تحديث الإحصائيات اليومية
     """
     try:
-        today = datetime.now().strftime("%Y-%m-%d")
+        now = datetime.now()
+        today = now.strftime("%Y-%m-%d")
+        tomorrow = (now + timedelta(days=1)).strftime("%Y-%m-%d")
         
         conn = get_connection()
         cur = conn.cursor()
         
-        # حساب الإحصائيات
+        # UPSERT واحد يحسب ويكتب داخل SQLite بلا جولة وسيطة
+        # المدى نصف المفتوح على collected_date يستفيد من الفهرس
+        # بعكس date(collected_date) = ? الذي يقيّم الدالة لكل صف
         cur.execute("""
+            INSERT INTO daily_stats 
+            (date, telegram_count, whatsapp_count, total_count)
             SELECT 
-                COUNT(CASE WHEN platform LIKE 'telegram%' THEN 1 END) as telegram_count,
-                COUNT(CASE WHEN platform = 'whatsapp' THEN 1 END) as whatsapp_count,
-                COUNT(*) as total_count
+                ?,
+                COUNT(CASE WHEN platform LIKE 'telegram%' THEN 1 END),
+                COUNT(CASE WHEN platform = 'whatsapp' THEN 1 END),
+                COUNT(*)
             FROM links 
-            WHERE date(collected_date) = ?
-        """, (today,))
-        
-        stats = cur.fetchone()
-        
-        if stats:
-            cur.execute("""
-                INSERT OR REPLACE INTO daily_stats 
-                (date, telegram_count, whatsapp_count, total_count)
-                VALUES (?, ?, ?, ?)
-            """, (today, stats[0], stats[1], stats[2]))
+            WHERE collected_date >= ? AND collected_date < ?
+            ON CONFLICT(date) DO UPDATE SET
+                telegram_count = excluded.telegram_count,
+                whatsapp_count = excluded.whatsapp_count,
+                total_count = excluded.total_count
+        """, (today, today, tomorrow))
         
         conn.commit()
-        conn.close()
         
     except Exception as e:
         logger.error(f"Failed to update daily stats: {e}")
@@ -326,92 +482,137 @@ def update_daily_stats():
 # Save Link
 # ======================
 
-def save_link(
-    url: str,
-    platform: str,
-    source_account: str,
-    chat_type: str,
-    chat_id: str,
-    message_date,
-    source_type: Optional[str] = None
-):
+def save_links(rows: List[tuple]):
     """
-    حفظ الرابط مرة واحدة فقط مع تحديث الإحصائيات
+    حفظ دفعة من الروابط في معاملة واحدة
+    كل صف: (url, platform, source_account, chat_type, chat_id, message_date, source_type)
     """
-    if not url:
+    if not rows:
         return
-    
+
     try:
         conn = get_connection()
         cur = conn.cursor()
-        
-        # التحقق أولاً إذا كان الرابط موجوداً
-        cur.execute("SELECT id FROM links WHERE url = ?", (url,))
-        existing = cur.fetchone()
-        
-        if existing:
-            conn.close()
-            return
-        
-        # إدراج الرابط الجديد
-        cur.execute(
-            """
-            INSERT OR IGNORE INTO links
-            (url, platform, source_account, chat_type, chat_id, message_date, source_type)
-            VALUES (?, ?, ?, ?, ?, ?, ?)
-            """,
+
+        # حجز قفل الكتابة مقدماً — دفعة واحدة بمعاملة واحدة
+        # بدل ترقية القفل في منتصف executemany تحت التزاحم
+        cur.execute("BEGIN IMMEDIATE")
+
+        params = [
             (
                 url,
                 platform,
+                # النوع مشتق من platform — عمود مباشر بلا جدول ربط
+                platform[9:] if platform.startswith('telegram_') else None,
                 source_account,
                 chat_type,
                 chat_id,
                 message_date.isoformat() if message_date else None,
                 source_type
             )
+            for (url, platform, source_account,
+                 chat_type, chat_id, message_date, source_type) in rows
+        ]
+
+        # قيد UNIQUE على url يتكفل بمنع التكرار — لا حاجة لـ SELECT قبل كل إدراج
+        changes_before = conn.total_changes
+        cur.executemany(
+            """
+            INSERT OR IGNORE INTO links
+            (url, platform, telegram_type, source_account, chat_type, chat_id, message_date, source_type)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            """,
+            params
         )
-        
-        # إذا كان الرابط من تليجرام، حفظ نوعه
-        if platform.startswith('telegram_'):
-            link_id = cur.lastrowid
-            telegram_type = platform.replace('telegram_', '')
-            
+        inserted = conn.total_changes - changes_before
+        if inserted:
             cur.execute(
-                """
-                INSERT INTO telegram_types (link_id, telegram_type)
-                VALUES (?, ?)
-                """,
-                (link_id, telegram_type)
+                "UPDATE meta SET value = value + ? WHERE key = 'link_count'",
+                (inserted,)
             )
-        
+            _bump_stats_version()
+
         conn.commit()
-        conn.close()
-        
-        # تحديث الإحصائيات بعد كل 100 رابط
+
+        # تحديث الإحصائيات بعد كل 100 رابط تقريباً
+        # قراءة العدّاد O(1) بدل مسح كامل للجدول
+        if not inserted:
+            return
         try:
-            cur.execute("SELECT COUNT(*) FROM links")
+            cur.execute("SELECT value FROM meta WHERE key = 'link_count'")
             total_count = cur.fetchone()[0]
-            if total_count % 100 == 0:
+            if total_count % 100 < len(params):
                 update_daily_stats()
         except:
             pass
-        
+
     except sqlite3.IntegrityError:
         # تجاهل الأخطاء المتعلقة بتكرار الروابط
         pass
     except Exception as e:
-        logger.error(f"Failed to save link {url}: {e}")
+        logger.error(f"Failed to save links batch: {e}")
     finally:
+        # لا نغلق الاتصال المشترك — فقط نضمن عدم بقاء معاملة مفتوحة
         try:
-            conn.close()
+            conn.rollback()
         except:
             pass
 
 
+def save_link(
+    url: str,
+    platform: str,
+    source_account: str,
+    chat_type: str,
+    chat_id: str,
+    message_date,
+    source_type: Optional[str] = None
+):
+    """
+    حفظ رابط واحد (غلاف حول save_links)
+    """
+    if not url:
+        return
+
+    save_links([(url, platform, source_account,
+                 chat_type, chat_id, message_date, source_type)])
+
+
 # ======================
 # Stats Functions
 # ======================
 
+# كاش قصير العمر لاستعلامات الإحصائيات المتكررة من الواجهة
+# يُبطل فور أي حفظ جديد عبر عدّاد نسخة
+_STATS_TTL = 60  # ثانية
+_stats_version = 0
+
+
+def _bump_stats_version():
+    global _stats_version
+    _stats_version += 1
+
+
+def _stats_cached(func):
+    """تخزين نتيجة دالة إحصائيات بلا وسائط مع TTL وإبطال بالنسخة"""
+    state = {"value": None, "expiry": 0.0, "version": -1}
+
+    @functools.wraps(func)
+    def wrapper():
+        now = time.monotonic()
+        if state["version"] == _stats_version and now < state["expiry"]:
+            return state["value"]
+
+        value = func()
+        state["value"] = value
+        state["expiry"] = now + _STATS_TTL
+        state["version"] = _stats_version
+        return value
+
+    return wrapper
+
+
+@_stats_cached
 def count_links_by_platform() -> Dict[str, int]:
     """
     إحصائيات الروابط حسب المنصة
@@ -433,7 +634,6 @@ def count_links_by_platform() -> Dict[str, int]:
         """)
         
         rows = cur.fetchall()
-        conn.close()
         
         return {platform: count for platform, count in rows}
     except Exception as e:
@@ -441,6 +641,7 @@ def count_links_by_platform() -> Dict[str, int]:
         return {}
 
 
+@_stats_cached
 def get_detailed_stats() -> Dict[str, any]:
     """
     إحصائيات مفصلة
@@ -458,9 +659,14 @@ def get_detailed_stats() -> Dict[str, any]:
         conn = get_connection()
         cur = conn.cursor()
         
-        # إجمالي الروابط
-        cur.execute("SELECT COUNT(*) FROM links")
-        stats["total"] = cur.fetchone()[0]
+        # إجمالي الروابط — من عدّاد meta المُصان بدل مسح الجدول
+        cur.execute("SELECT value FROM meta WHERE key = 'link_count'")
+        row = cur.fetchone()
+        if row is not None:
+            stats["total"] = row[0]
+        else:
+            cur.execute("SELECT COUNT(*) FROM links")
+            stats["total"] = cur.fetchone()[0]
         
         # حسب المنصة
         cur.execute("""
@@ -471,12 +677,12 @@ def get_detailed_stats() -> Dict[str, any]:
         """)
         stats["platforms"] = dict(cur.fetchall())
         
-        # حسب نوع تليجرام
+        # حسب نوع تليجرام — من العمود مباشرة بلا JOIN
         cur.execute("""
-            SELECT tt.telegram_type, COUNT(*)
-            FROM telegram_types tt
-            JOIN links l ON tt.link_id = l.id
-            GROUP BY tt.telegram_type
+            SELECT telegram_type, COUNT(*)
+            FROM links
+            WHERE telegram_type IS NOT NULL
+            GROUP BY telegram_type
             ORDER BY COUNT(*) DESC
         """)
         stats["telegram_types"] = dict(cur.fetchall())
@@ -513,7 +719,6 @@ def get_detailed_stats() -> Dict[str, any]:
             for row in cur.fetchall()
         ]
         
-        conn.close()
         
     except Exception as e:
         logger.error(f"Error getting detailed stats: {e}")
@@ -529,26 +734,43 @@ def get_links_by_platform_and_type(
     platform: str,
     chat_type: str,
     limit: int = 50,
-    offset: int = 0
-) -> List[Tuple[str, str, str, str]]:
+    offset: int = 0,
+    before: Optional[Tuple[str, int]] = None
+) -> List[Tuple[str, str, str, str, int]]:
     """
     جلب الروابط حسب المنصة والنوع
+
+    before: مؤشر (message_date, id) لترقيم بالمفتاح (keyset) —
+    تكلفته O(limit) مهما تعمقت الصفحة، بعكس OFFSET الذي
+    يمسح ويتجاهل صفوف كل الصفحات السابقة
+    العمود الأخير في كل صف هو id لبناء مؤشر الصفحة التالية
     """
     try:
         conn = get_connection()
         cur = conn.cursor()
         
-        query = """
-            SELECT url, platform, chat_type, message_date
-            FROM links
-            WHERE platform = ? AND chat_type = ?
-            ORDER BY message_date DESC
-            LIMIT ? OFFSET ?
-        """
+        if before:
+            query = """
+                SELECT url, platform, chat_type, message_date, id
+                FROM links
+                WHERE platform = ? AND chat_type = ?
+                  AND (message_date, id) < (?, ?)
+                ORDER BY message_date DESC, id DESC
+                LIMIT ?
+            """
+            args = (platform, chat_type, before[0], before[1], limit)
+        else:
+            query = """
+                SELECT url, platform, chat_type, message_date, id
+                FROM links
+                WHERE platform = ? AND chat_type = ?
+                ORDER BY message_date DESC, id DESC
+                LIMIT ? OFFSET ?
+            """
+            args = (platform, chat_type, limit, offset)
         
-        cur.execute(query, (platform, chat_type, limit, offset))
+        cur.execute(query, args)
         rows = cur.fetchall()
-        conn.close()
         
         return rows
     except Exception as e:
@@ -559,27 +781,39 @@ def get_links_by_platform_and_type(
 def get_links_by_telegram_type(
     telegram_type: str,
     limit: int = 50,
-    offset: int = 0
-) -> List[Tuple[str, str, str]]:
+    offset: int = 0,
+    before: Optional[Tuple[str, int]] = None
+) -> List[Tuple[str, str, str, int]]:
     """
     جلب روابط تليجرام حسب النوع
+    before: مؤشر (message_date, id) كما في get_links_by_platform_and_type
     """
     try:
         conn = get_connection()
         cur = conn.cursor()
         
-        query = """
-            SELECT l.url, l.chat_type, l.message_date
-            FROM links l
-            JOIN telegram_types tt ON l.id = tt.link_id
-            WHERE tt.telegram_type = ?
-            ORDER BY l.message_date DESC
-            LIMIT ? OFFSET ?
-        """
+        if before:
+            query = """
+                SELECT url, chat_type, message_date, id
+                FROM links
+                WHERE telegram_type = ?
+                  AND (message_date, id) < (?, ?)
+                ORDER BY message_date DESC, id DESC
+                LIMIT ?
+            """
+            args = (telegram_type, before[0], before[1], limit)
+        else:
+            query = """
+                SELECT url, chat_type, message_date, id
+                FROM links
+                WHERE telegram_type = ?
+                ORDER BY message_date DESC, id DESC
+                LIMIT ? OFFSET ?
+            """
+            args = (telegram_type, limit, offset)
         
-        cur.execute(query, (telegram_type, limit, offset))
+        cur.execute(query, args)
         rows = cur.fetchall()
-        conn.close()
         
         return rows
     except Exception as e:
@@ -607,11 +841,9 @@ def export_links(platform: str = "all", telegram_type: str = None) -> Optional[s
             filename = "links_all.txt"
         elif telegram_type:
             cur.execute("""
-                SELECT l.url
-                FROM links l
-                JOIN telegram_types tt ON l.id = tt.link_id
-                WHERE tt.telegram_type = ?
-                ORDER BY l.message_date ASC
+                SELECT url FROM links
+                WHERE telegram_type = ?
+                ORDER BY message_date ASC
             """, (telegram_type,))
             filename = f"links_telegram_{telegram_type}.txt"
         else:
@@ -622,33 +854,29 @@ def export_links(platform: str = "all", telegram_type: str = None) -> Optional[s
             """, (platform,))
             filename = f"links_{platform}.txt"
         
-        rows = cur.fetchall()
-        conn.close()
-        
-        if not rows:
-            return None
-        
         # إنشاء مجلد التصدير
         export_dir = "exports"
         os.makedirs(export_dir, exist_ok=True)
         
-        # تجنب تكرار أسماء الملفات
+        # mkstemp يعطي اسماً فريداً مباشرة بلا حلقة فحص وجود
         base_name = filename.replace(".txt", "")
-        counter = 1
-        final_filename = filename
-        
-        while os.path.exists(os.path.join(export_dir, final_filename)):
-            final_filename = f"{base_name}_{counter}.txt"
-            counter += 1
+        fd, path = tempfile.mkstemp(
+            prefix=base_name + "_", suffix=".txt", dir=export_dir
+        )
         
-        path = os.path.join(export_dir, final_filename)
+        # بث الصفوف إلى الملف على دفعات بدل fetchall —
+        # ذاكرة ثابتة مهما بلغ حجم التصدير
+        total = 0
+        with os.fdopen(fd, "w", encoding="utf-8", buffering=1 << 20) as f:
+            for batch in iter(lambda: cur.fetchmany(10000), []):
+                f.writelines(url + "\n" for (url,) in batch)
+                total += len(batch)
         
-        # كتابة الملف
-        with open(path, "w", encoding="utf-8") as f:
-            for (url,) in rows:
-                f.write(url + "\n")
+        if not total:
+            os.remove(path)
+            return None
         
-        logger.info(f"Exported {len(rows)} links to {path}")
+        logger.info(f"Exported {total} links to {path}")
         return path
         
     except Exception as e:
@@ -665,30 +893,42 @@ def get_database_size() -> Dict[str, any]:
     الحصول على معلومات حجم قاعدة البيانات
     """
     try:
-        size_bytes = os.path.getsize(DATABASE_PATH)
-        size_mb = size_bytes / (1024 * 1024)
-        
         conn = get_connection()
         cur = conn.cursor()
-        
-        # عدد السجلات
-        cur.execute("SELECT COUNT(*) FROM links")
-        total_links = cur.fetchone()[0]
-        
-        # مساحة الجداول
-        cur.execute("""
-            SELECT name, (pgsize * page_count) as size_bytes
-            FROM dbstat
-            ORDER BY size_bytes DESC
-        """)
-        
-        table_sizes = [
-            {"table": row[0], "size_mb": row[1] / (1024 * 1024)}
-            for row in cur.fetchall()
-        ]
-        
-        conn.close()
-        
+
+        # الحجم الكلي من الـ PRAGMAs — O(1) بدل مسح dbstat لكل الصفحات
+        page_count = cur.execute("PRAGMA page_count").fetchone()[0]
+        page_size = cur.execute("PRAGMA page_size").fetchone()[0]
+        size_bytes = page_count * page_size
+        size_mb = size_bytes / (1024 * 1024)
+
+        # عدد السجلات — من عدّاد meta المُصان بدل COUNT(*)
+        cur.execute("SELECT value FROM meta WHERE key = 'link_count'")
+        row = cur.fetchone()
+        if row is not None:
+            total_links = row[0]
+        else:
+            cur.execute("SELECT COUNT(*) FROM links")
+            total_links = cur.fetchone()[0]
+
+        # مساحة الجداول — التجميع داخل SQL بدل صف لكل صفحة
+        # (dbstat وحدة اختيارية؛ غيابها لا يُسقط بقية المعلومات)
+        table_sizes = []
+        try:
+            cur.execute("""
+                SELECT name, SUM(pgsize) as size_bytes
+                FROM dbstat
+                GROUP BY name
+                ORDER BY size_bytes DESC
+            """)
+            table_sizes = [
+                {"table": row[0], "size_mb": row[1] / (1024 * 1024)}
+                for row in cur.fetchall()
+            ]
+        except sqlite3.Error:
+            logger.debug("dbstat not available; skipping table size breakdown")
+
+
         return {
             "total_size_mb": f"{size_mb:.2f}",
             "total_size_bytes": size_bytes,
@@ -718,21 +958,37 @@ def clean_database():
             logger.info(f"Backup created before cleanup: {backup_file}")
             
             # حذف الروابط المكررة (في حال وجود أي مشكلة)
+            # قيد UNIQUE(url) يمنع التكرار أصلاً فهذا مسار دفاعي؛
+            # ROW_NUMBER يحسم التكرار بمسح مرتب واحد بدل NOT IN
+            # التي تعيد تقييم التجميع لكل صف
             conn = get_connection()
             cur = conn.cursor()
-            
+
+            # فرق total_changes قبل/بعد (كما في save_links) —
+            # القيمة المطلقة تراكمية على الاتصال المخزّن فتحسب
+            # كل دفعات save_links السابقة كأنها مكررات محذوفة
+            changes_before = conn.total_changes
+
             cur.execute("""
-                DELETE FROM links
-                WHERE id NOT IN (
-                    SELECT MIN(id)
+                WITH d AS (
+                    SELECT id,
+                           ROW_NUMBER() OVER (PARTITION BY url ORDER BY id) AS rn
                     FROM links
-                    GROUP BY url
                 )
+                DELETE FROM links
+                WHERE id IN (SELECT id FROM d WHERE rn > 1)
+            """)
+
+            deleted_count = conn.total_changes - changes_before
+            
+            # إعادة مزامنة عدّاد meta بعد الحذف
+            cur.execute("""
+                UPDATE meta SET value = (SELECT COUNT(*) FROM links)
+                WHERE key = 'link_count'
             """)
             
-            deleted_count = conn.total_changes
             conn.commit()
-            conn.close()
+            _bump_stats_version()
             
             # تحسين قاعدة البيانات
             optimize_database()
@@ -1,9 +1,12 @@
+import asyncio
 import os
 import tempfile
 import hashlib
 import logging
+import mmap
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
 from typing import List, Set, Dict, Tuple
-from datetime import datetime
 
 from telethon import TelegramClient
 from telethon.tl.types import Message
@@ -20,7 +23,9 @@ logger = logging.getLogger(__name__)
 # File Processing Tracker
 # ======================
 
-_processed_files: Dict[str, Dict] = {}  # تتبع الملفات المعالجة
+# تتبع الملفات المعالجة — OrderedDict يعطي إزاحة LRU بتكلفة O(1)
+# بدل فرز كل المفاتيح عند امتلاء الكاش
+_processed_files: "OrderedDict[str, Dict]" = OrderedDict()
 MAX_CACHE_SIZE = 1000  # الحد الأقصى للملفات في الكاش
 
 
@@ -29,12 +34,18 @@ MAX_CACHE_SIZE = 1000  # الحد الأقصى للملفات في الكاش
 # ======================
 
 def get_file_hash(file_path: str) -> str:
-    """إنشاء بصمة فريدة للملف"""
+    """
+    إنشاء بصمة فريدة للملف
+    sha256 من OpenSSL يستغل تسريع SHA-NI في المعالج،
+    و mmap يمرر الملف كله دفعة واحدة بدل حلقة قطع 4KB
+    """
     try:
-        hasher = hashlib.md5()
+        hasher = hashlib.sha256()
         with open(file_path, 'rb') as f:
-            for chunk in iter(lambda: f.read(4096), b''):
-                hasher.update(chunk)
+            size = os.fstat(f.fileno()).st_size
+            if size:
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                    hasher.update(mm)
         return hasher.hexdigest()
     except Exception as e:
         logger.error(f"Error calculating file hash: {e}")
@@ -62,13 +73,8 @@ def get_file_identifier(message: Message) -> Tuple[str, str]:
 def is_file_already_processed(file_identifier: str, file_hash: str = "") -> bool:
     """التحقق إذا كان الملف قد تم معالجته مسبقاً"""
     if file_identifier in _processed_files:
-        cached_file = _processed_files[file_identifier]
-        
-        # إذا كان هناك hash، تحقق منه
-        if file_hash and cached_file.get('hash') == file_hash:
-            return True
-        
-        # إذا لم يكن هناك hash، اعتبر أن الملف قد تمت معالجته
+        # تحديث موضع الملف في ترتيب LRU
+        _processed_files.move_to_end(file_identifier)
         return True
     
     return False
@@ -80,22 +86,15 @@ def is_file_already_processed(file_identifier: str, file_hash: str = "") -> bool
 
 def add_to_processed_cache(file_identifier: str, file_hash: str, links_found: int):
     """إضافة ملف إلى الكاش"""
-    # تنظيف الكاش إذا تجاوز الحد
-    if len(_processed_files) >= MAX_CACHE_SIZE:
-        # حذف أقدم الملفات
-        oldest_keys = sorted(
-            _processed_files.keys(),
-            key=lambda k: _processed_files[k].get('timestamp', 0)
-        )[:100]  # حذف 100 ملف قديم
-        for key in oldest_keys:
-            del _processed_files[key]
-    
     # إضافة الملف الجديد
     _processed_files[file_identifier] = {
         'hash': file_hash,
-        'timestamp': datetime.now().timestamp(),
         'links_found': links_found
     }
+    
+    # إزاحة الأقدم واحداً واحداً — O(1) لكل عملية
+    while len(_processed_files) > MAX_CACHE_SIZE:
+        _processed_files.popitem(last=False)
 
 def clear_file_cache():
     """مسح كاش الملفات"""
@@ -156,30 +155,49 @@ SUPPORTED_EXTENSIONS = {
     '.odt': 'application/vnd.oasis.opendocument.text'
 }
 
+# مجموعتا بحث O(1) — بدل حلقة فحص جزئي على قيم MIME لكل ملف وارد
+_SUPPORTED_EXTS = frozenset(SUPPORTED_EXTENSIONS)
+_SUPPORTED_MIMES = frozenset(SUPPORTED_EXTENSIONS.values())
+
+
 def is_file_supported(filename: str, mime_type: str = "") -> bool:
     """التحقق إذا كان نوع الملف مدعوماً"""
     if not filename:
         return False
     
-    ext = os.path.splitext(filename.lower())[1]
-    
-    # التحقق من الامتداد
-    if ext in SUPPORTED_EXTENSIONS:
-        return True
-    
-    # التحقق من MIME type
-    if mime_type:
-        for supported_mime in SUPPORTED_EXTENSIONS.values():
-            if mime_type in supported_mime:
-                return True
-    
-    return False
+    ext = os.path.splitext(filename)[1].lower()
+    return ext in _SUPPORTED_EXTS or mime_type in _SUPPORTED_MIMES
 
 
 # ======================
 # Link Extraction Functions
 # ======================
 
+# حد أعلى للروابط المستخرجة من ملف واحد
+# يمنع ملف PDF مرضياً من احتكار المستخرج لدقائق
+MAX_LINKS_PER_FILE = 500
+
+# كل كم صفحة تُفحص النصوص المتراكمة (تمريرة regex واحدة للدفعة)
+_SCAN_EVERY_PAGES = 16
+
+
+def _scan_texts(texts: List[str], links: Set[str]):
+    """تفريغ دفعة نصوص متراكمة في مجموعة الروابط بتمريرة regex واحدة"""
+    if not texts:
+        return
+
+    blob = "\n".join(texts)
+    texts.clear()
+
+    # فحص سريع يتخطى الدفعات الخالية من أي رابط
+    if 'http' not in blob:
+        return
+
+    for link in URL_REGEX.findall(blob):
+        if is_valid_link_for_extraction(link):
+            links.add(link.strip())
+
+
 def _extract_from_pdf(path: str) -> Set[str]:
     """استخراج الروابط من PDF"""
     links: Set[str] = set()
@@ -189,36 +207,43 @@ def _extract_from_pdf(path: str) -> Set[str]:
         try:
             from PyPDF2 import PdfReader
             reader = PdfReader(path)
-            
+
+            # تجميع نصوص الصفحات وفحصها على دفعات
+            # مع توقف مبكر إذا بلغ الملف حد الروابط المسموح
+            texts = []
             for page_num, page in enumerate(reader.pages, 1):
                 try:
-                    text = page.extract_text() or ""
-                    found_links = URL_REGEX.findall(text)
-                    
-                    # تصفية الروابط
-                    for link in found_links:
-                        if is_valid_link_for_extraction(link):
-                            links.add(link.strip())
-                    
+                    texts.append(page.extract_text() or "")
                 except Exception as e:
                     logger.warning(f"Error extracting from PDF page {page_num}: {e}")
-                    
+
+                if page_num % _SCAN_EVERY_PAGES == 0:
+                    _scan_texts(texts, links)
+                    if len(links) >= MAX_LINKS_PER_FILE:
+                        logger.warning(f"Link cap reached at page {page_num}: {os.path.basename(path)}")
+                        break
+
+            _scan_texts(texts, links)
+
         except ImportError:
             # استخدام pdfplumber كبديل
             try:
                 import pdfplumber
+                texts = []
                 with pdfplumber.open(path) as pdf:
                     for page_num, page in enumerate(pdf.pages, 1):
                         try:
-                            text = page.extract_text() or ""
-                            found_links = URL_REGEX.findall(text)
-                            
-                            for link in found_links:
-                                if is_valid_link_for_extraction(link):
-                                    links.add(link.strip())
-                                    
+                            texts.append(page.extract_text() or "")
                         except Exception as e:
                             logger.warning(f"Error extracting from PDF page {page_num} with pdfplumber: {e}")
+
+                        if page_num % _SCAN_EVERY_PAGES == 0:
+                            _scan_texts(texts, links)
+                            if len(links) >= MAX_LINKS_PER_FILE:
+                                logger.warning(f"Link cap reached at page {page_num}: {os.path.basename(path)}")
+                                break
+
+                _scan_texts(texts, links)
             except ImportError:
                 logger.error("No PDF extraction library found. Install PyPDF2 or pdfplumber.")
                 
@@ -238,8 +263,9 @@ def _extract_from_docx(path: str) -> Set[str]:
         doc = Document(path)
         
         # استخراج من الفقرات
+        # فحص 'http' السريع يتخطى الفقرات الخالية من الروابط قبل الـ regex
         for para in doc.paragraphs:
-            if para.text:
+            if para.text and 'http' in para.text:
                 found_links = URL_REGEX.findall(para.text)
                 for link in found_links:
                     if is_valid_link_for_extraction(link):
@@ -249,7 +275,7 @@ def _extract_from_docx(path: str) -> Set[str]:
         for table in doc.tables:
             for row in table.rows:
                 for cell in row.cells:
-                    if cell.text:
+                    if cell.text and 'http' in cell.text:
                         found_links = URL_REGEX.findall(cell.text)
                         for link in found_links:
                             if is_valid_link_for_extraction(link):
@@ -258,7 +284,7 @@ def _extract_from_docx(path: str) -> Set[str]:
         # استخراج من التعليقات (إن وجدت)
         if hasattr(doc, 'comments'):
             for comment in doc.comments:
-                if comment.text:
+                if comment.text and 'http' in comment.text:
                     found_links = URL_REGEX.findall(comment.text)
                     for link in found_links:
                         if is_valid_link_for_extraction(link):
@@ -272,22 +298,53 @@ def _extract_from_docx(path: str) -> Set[str]:
     return links
 
 
+# نافذة التداخل بين مقاطع القراءة — أطول من أي رابط متوقع
+# حتى لا يضيع رابط مقطوع على حدود المقطع
+_TXT_OVERLAP = 2048
+
+
 def _extract_from_txt(path: str) -> Set[str]:
-    """استخراج الروابط من ملفات نصية"""
+    """
+    استخراج الروابط من ملفات نصية
+    القراءة على مقاطع 1MB بدل تحميل الملف كله كسلسلة واحدة —
+    ملف سجل بحجم جيجابايت يُفحص بذاكرة ثابتة
+    """
     links: Set[str] = set()
-    
+
     try:
         with open(path, 'r', encoding='utf-8', errors='ignore') as f:
-            content = f.read()
-            found_links = URL_REGEX.findall(content)
-            
-            for link in found_links:
+            buf = ""
+            while True:
+                chunk = f.read(1 << 20)
+                if not chunk:
+                    break
+                buf += chunk
+
+                # فحص سريع يتخطى المقاطع الخالية من أي رابط
+                if 'http' not in buf:
+                    buf = buf[-_TXT_OVERLAP:]
+                    continue
+
+                # فحص المقطع مع ترك ما قد يكون رابطاً مقطوعاً للنافذة التالية
+                cut = len(buf) - _TXT_OVERLAP
+                keep = cut
+                for m in URL_REGEX.finditer(buf):
+                    if m.end() > cut:
+                        keep = min(keep, m.start())
+                        break
+                    if is_valid_link_for_extraction(m.group(0)):
+                        links.add(m.group(0).strip())
+
+                buf = buf[keep:]
+
+            # التمريرة الأخيرة على بقية النافذة
+            for link in URL_REGEX.findall(buf):
                 if is_valid_link_for_extraction(link):
                     links.add(link.strip())
-                    
+
     except Exception as e:
         logger.error(f"Error extracting from text file {os.path.basename(path)}: {e}")
-    
+
     return links
 
 
@@ -325,6 +382,35 @@ def _extract_from_doc(path: str) -> Set[str]:
     return links
 
 
+# ======================
+# CPU Pool Dispatch
+# ======================
+
+# مجمّع عمليات للمستخرجات المقيدة بالمعالج
+# حتى لا يحجب تحليل PDF/DOCX حلقة asyncio أثناء التحميلات الأخرى
+_CPU_POOL = ProcessPoolExecutor(max_workers=os.cpu_count())
+
+
+def _extract_dispatch(ext: str, mime_type: str, path: str) -> Set[str]:
+    """
+    اختيار المستخرج المناسب حسب نوع الملف
+    دالة على مستوى الوحدة حتى تكون قابلة للإرسال إلى عمليات المجمّع
+    """
+    if ext == '.pdf' or mime_type == 'application/pdf':
+        return _extract_from_pdf(path)
+
+    if ext == '.docx' or mime_type == 'application/vnd.openxmlformats-officedocument.wordprocessingml.document':
+        return _extract_from_docx(path)
+
+    if ext == '.doc' or mime_type == 'application/msword':
+        return _extract_from_doc(path)
+
+    if ext == '.txt' or mime_type == 'text/plain':
+        return _extract_from_txt(path)
+
+    return set()
+
+
 # ======================
 # Main Extraction Function
 # ======================
@@ -375,28 +461,17 @@ async def extract_links_from_file(
             logger.error(f"Failed to download file: {filename}")
             return []
         
-        # حساب بصمة الملف
-        file_hash = get_file_hash(temp_path)
-        
-        # التحقق مرة أخرى باستخدام البصمة
-        if file_hash and is_file_already_processed(file_identifier, file_hash):
-            logger.info(f"File already processed (by hash): {filename}")
-            return []
+        # لا بصمة محتوى في المسار السعيد:
+        # معرف تليجرام (file_id + الحجم) حسم التكرار قبل التحميل أصلاً،
+        # وحساب sha256 لملف 50MB كان تمريرة كاملة إضافية بلا فائدة
         
         # استخراج الروابط حسب نوع الملف
+        # التحليل يجري في عملية منفصلة فتبقى الحلقة حرة للتحميلات المتوازية
         ext = os.path.splitext(filename.lower())[1]
-        
-        if ext == '.pdf' or mime_type == 'application/pdf':
-            links = _extract_from_pdf(temp_path)
-            
-        elif ext == '.docx' or mime_type == 'application/vnd.openxmlformats-officedocument.wordprocessingml.document':
-            links = _extract_from_docx(temp_path)
-            
-        elif ext == '.doc' or mime_type == 'application/msword':
-            links = _extract_from_doc(temp_path)
-            
-        elif ext == '.txt' or mime_type == 'text/plain':
-            links = _extract_from_txt(temp_path)
+
+        links = await asyncio.get_running_loop().run_in_executor(
+            _CPU_POOL, _extract_dispatch, ext, mime_type, temp_path
+        )
         
         # إضافة الملف إلى الكاش
         add_to_processed_cache(file_identifier, file_hash, len(links))
@@ -1,5 +1,6 @@
+import functools
 import re
-from typing import List, Set, Optional, Tuple
+from typing import Iterator, Optional, Tuple
 from telethon.tl.types import Message
 
 
@@ -13,33 +14,10 @@ URL_REGEX = re.compile(
 )
 
 
-# ======================
-# أنماط المنصات (معدلة - فقط تليجرام وواتساب)
-# ======================
-
-PLATFORM_PATTERNS = {
-    "telegram": re.compile(r"(t\.me|telegram\.me)", re.IGNORECASE),
-    "whatsapp": re.compile(r"(wa\.me|chat\.whatsapp\.com)", re.IGNORECASE),
-    # تم إزالة باقي المنصات
-}
-
-
 # ======================
 # أنماط روابط تليجرام المطلوبة
 # ======================
 
-# النوع الأول: يبدأ بعلامة +
-TG_PLUS_INVITE_REGEX = re.compile(
-    r"https?://t\.me/\+[A-Za-z0-9_-]+",
-    re.IGNORECASE
-)
-
-# النوع الثاني: بدون علامة + (فقط أرقام وحروف)
-TG_WITHOUT_PLUS_REGEX = re.compile(
-    r"https?://t\.me/[A-Za-z0-9_-]+(?!/)",
-    re.IGNORECASE
-)
-
 # روابط تليجرام المرفوضة
 TG_REJECTED_PATTERNS = [
     re.compile(r"/bot/", re.IGNORECASE),
@@ -48,59 +26,80 @@ TG_REJECTED_PATTERNS = [
     re.compile(r"t\.me/invite", re.IGNORECASE),
 ]
 
+# نمطا الرفض والقبول مدموجان في تعبيرين مسبقي الترجمة —
+# فحصان بدل حلقة أنماط وثلاث عمليات بحث جزئي لكل رابط
+_REJECT_RE = re.compile(
+    "|".join(p.pattern for p in TG_REJECTED_PATTERNS),
+    re.IGNORECASE
+)
+_ACCEPT_RE = re.compile(
+    r"t\.me|telegram\.me|whatsapp\.com|wa\.me",
+    re.IGNORECASE
+)
 
-# ======================
-# أنماط روابط واتساب
-# ======================
+# نمط واحد يجمع كل شروط رابط تليجرام الصالح:
+# - مسار واحد فقط بعد t.me/
+# - رفض bot/invite من البداية
+# - السماح بـ query parameters فقط بعد المسار
+TME_VALID_REGEX = re.compile(
+    r"(?i)^(?:https?://)?t\.me/"
+    r"(?!bot|invite)"
+    r"(\+?[A-Za-z0-9_-]+)"
+    r"(?:\?.*)?$"
+)
 
-WA_GROUP_REGEX = re.compile(r"https?://chat\.whatsapp\.com/[A-Za-z0-9]+", re.I)
-WA_PHONE_REGEX = re.compile(r"https?://wa\.me/\d+", re.I)
+# أرقام الهواتف المرفوضة (t.me/+123456789)
+TME_PHONE_REGEX = re.compile(r"^\+\d{7,12}$")
+
+# نمط موحّد يستخرج ويصنّف في تمريرة واحدة:
+# اسم المجموعة المطابِقة يحدد المنصة والنوع مباشرة
+CLASSIFY_REGEX = re.compile(
+    r"(?i)^(?:https?://)?(?:"
+    r"(?P<tg_plus>t\.me/\+[A-Za-z0-9_-]+)"
+    r"|(?P<tg>t\.me/(?!bot|invite)[A-Za-z0-9_-]+)"
+    r"|(?P<wa_group>chat\.whatsapp\.com/[A-Za-z0-9]+)"
+    r")(?:\?.*)?$"
+)
 
 
 # ======================
 # استخراج الروابط من الرسالة (معدل)
 # ======================
 
-def extract_links_from_message(message: Message) -> List[str]:
+def extract_links_from_message(message: Message) -> Iterator[str]:
     """
     استخراج الروابط من:
     - نص الرسالة
     - الكابتشن
     - الروابط المخفية
-    """
-    links: Set[str] = set()
 
+    مولّد — لا يبني قائمة وسيطة؛ إزالة التكرار مسؤولية المستهلك
+    """
     text = message.text or message.message or ""
-    if text:
-        found_links = URL_REGEX.findall(text)
-        for link in found_links:
+    # فحص سريع قبل الـ regex — أغلب الرسائل بلا روابط أصلاً
+    if text and 'http' in text:
+        for link in URL_REGEX.findall(text):
             # تصفية الروابط على مستوى الاستخراج
             if is_valid_link_for_extraction(link):
-                links.add(link.strip())
-
-    return list(links)
+                yield link.strip()
 
 
 # ======================
 # استخراج روابط الأزرار
 # ======================
 
-def extract_buttons_links(message: Message) -> List[str]:
+def extract_buttons_links(message: Message) -> Iterator[str]:
     """
-    استخراج الروابط من أزرار الرسالة
+    استخراج الروابط من أزرار الرسالة (مولّد)
     """
-    links: Set[str] = set()
-    
     if message.reply_markup:
         for row in message.reply_markup.rows:
             for button in row.buttons:
-                if hasattr(button, "url") and button.url:
-                    link = button.url
-                    # تصفية الروابط على مستوى الاستخراج
-                    if is_valid_link_for_extraction(link):
-                        links.add(link.strip())
-    
-    return list(links)
+                # بحث صفة واحد بدل hasattr ثم قراءة ثانية
+                link = getattr(button, "url", None)
+                # تصفية الروابط على مستوى الاستخراج
+                if link and is_valid_link_for_extraction(link):
+                    yield link.strip()
 
 
 # ======================
@@ -114,102 +113,28 @@ def is_valid_link_for_extraction(link: str) -> bool:
     """
     if not link:
         return False
-    
-    link_lower = link.lower()
-    
+
     # رفض الروابط غير المرغوبة مبكراً
-    if any(pattern.search(link_lower) for pattern in TG_REJECTED_PATTERNS):
+    # النمطان غير حساسين لحالة الأحرف فلا حاجة لنسخة lower
+    if _REJECT_RE.search(link):
         return False
-    
-    # قبول فقط روابط تليجرام وواتساب
-    if "t.me" in link_lower or "telegram.me" in link_lower:
-        return True
-    
-    if "whatsapp.com" in link_lower or "wa.me" in link_lower:
-        return True
-    
-    # رفض كل الروابط الأخرى
-    return False
-
-
-# ======================
-# تصنيف المنصة (معدل)
-# ======================
 
-def classify_platform(url: str) -> str:
-    """
-    تصنيف المنصة - يعيد فقط 'telegram' أو 'whatsapp' أو 'other'
-    """
-    url_lower = url.lower()
-    
-    if "t.me" in url_lower or "telegram.me" in url_lower:
-        return "telegram"
-    
-    if "whatsapp.com" in url_lower or "wa.me" in url_lower:
-        return "whatsapp"
-    
-    return "other"
-
-
-# ======================
-# تصنيف روابط تليجرام
-# ======================
-
-def classify_telegram_link(url: str) -> Tuple[str, str]:
-    """
-    تصنيف رابط تليجرام إلى نوعين
-    
-    Returns:
-        (telegram_type, chat_type)
-        telegram_type: 'invite_with_plus' أو 'invite_without_plus'
-        chat_type: 'group' أو 'channel'
-    """
-    url_lower = url.lower()
-    
-    # تحديد نوع الرابط
-    if TG_PLUS_INVITE_REGEX.match(url):
-        telegram_type = "invite_with_plus"
-        chat_type = "group"  # روابط + عادة تكون لجروبات
-    elif TG_WITHOUT_PLUS_REGEX.match(url):
-        telegram_type = "invite_without_plus"
-        # محاولة التخمين إذا كان قناة أو مجموعة
-        if any(pattern in url_lower for pattern in ["c/", "channel/"]):
-            chat_type = "channel"
-        else:
-            chat_type = "group"
-    else:
-        # هذا لا يجب أن يحدث إذا استخدمنا is_valid_telegram_link أولاً
-        telegram_type = "unknown"
-        chat_type = "unknown"
-    
-    return telegram_type, chat_type
+    # قبول فقط روابط تليجرام وواتساب — رفض كل الروابط الأخرى
+    return _ACCEPT_RE.search(link) is not None
 
 
 # ======================
-# تصنيف روابط واتساب
+# الفلترة والتصنيف النهائي
 # ======================
 
-def classify_whatsapp_link(url: str) -> str:
-    """
-    تصنيف رابط واتساب
-    
-    Returns:
-        chat_type: 'group' أو 'private'
-    """
-    url_lower = url.lower()
-    
-    if WA_GROUP_REGEX.match(url):
-        return "group"
-    elif WA_PHONE_REGEX.match(url):
-        return "private"
-    else:
-        return "unknown"
+# نواتج التصنيف الثابتة — نفس الكائنات تُعاد لكل الروابط المقبولة
+# بدل بناء tuple جديد عند كل استدعاء
+_TG_PLUS_GROUP = ("telegram_invite_with_plus", "group")
+_TG_PLAIN_GROUP = ("telegram_invite_without_plus", "group")
+_WA_GROUP = ("whatsapp", "group")
 
 
-# ======================
-# الفلترة والتصنيف النهائي
-# ======================
-
+@functools.lru_cache(maxsize=131072)
 def filter_and_classify_link(url: str) -> Optional[Tuple[str, str]]:
     """
     فلترة الرابط قبل الحفظ
@@ -223,46 +148,34 @@ def filter_and_classify_link(url: str) -> Optional[Tuple[str, str]]:
         - 'telegram_invite_with_plus' لروابط تليجرام مع +
         - 'telegram_invite_without_plus' لروابط تليجرام بدون +
     """
-    
-    # فحص سريع أولي
-    if not is_valid_link_for_extraction(url):
+    m = CLASSIFY_REGEX.match(url.strip())
+    if m is None:
         return None
-    
+
+    kind = m.lastgroup
+
     # ===== Telegram =====
-    if "t.me" in url.lower() or "telegram.me" in url.lower():
-        # التحقق من صحة رابط تليجرام
-        if not is_valid_telegram_link(url):
+    if kind == "tg_plus":
+        # رفض أرقام الهواتف (t.me/+123456789)
+        segment = m.group("tg_plus").partition("/")[2]
+        if TME_PHONE_REGEX.match(segment):
             return None
-        
-        # تصنيف رابط تليجرام
-        telegram_type, chat_type = classify_telegram_link(url)
-        
-        # إعادة النتيجة مع platform_type المناسب
-        platform_type = f"telegram_{telegram_type}"
-        return (platform_type, chat_type)
-    
+        return _TG_PLUS_GROUP
+
+    if kind == "tg":
+        return _TG_PLAIN_GROUP
+
     # ===== WhatsApp =====
-    elif "whatsapp.com" in url.lower() or "wa.me" in url.lower():
-        chat_type = classify_whatsapp_link(url)
-        
-        # رفض الروابط الخاصة (أرقام هواتف)
-        if chat_type == "private":
-            return None
-        
-        # قبول فقط روابط المجموعات
-        if chat_type == "group":
-            return ("whatsapp", "group")
-        
-        return None
-    
-    # ===== رفض كل الروابط الأخرى =====
-    return None
+    # wa.me (أرقام هواتف خاصة) غير مشمولة في النمط أصلاً
+    return _WA_GROUP
+
 
 
 # ======================
 # التحقق من صحة رابط تليجرام (للاستخدام في collector)
 # ======================
 
+@functools.lru_cache(maxsize=65536)
 def is_valid_telegram_link(link: str) -> bool:
     """
     تحقق إذا كان الرابط رابط تليجرام صالح للتجميع
@@ -278,50 +191,15 @@ def is_valid_telegram_link(link: str) -> bool:
     - t.me/+1-9 (الهواتف - مرفوضة)
     - روابط بمسارات متعددة
     """
-    link_lower = link.lower().strip()
-    
-    # تجاهل الروابط التي تحتوي على أنماط مرفوضة
-    if any(pattern.search(link_lower) for pattern in TG_REJECTED_PATTERNS):
-        return False
-    
-    # التحقق من وجود t.me
-    if 't.me/' not in link_lower:
+    m = TME_VALID_REGEX.match(link.strip())
+    if not m:
         return False
-    
-    # استخراج المسار
-    parts = link_lower.split('t.me/')
-    if len(parts) < 2:
-        return False
-    
-    path_part = parts[1].split('?')[0]  # إزالة query parameters
-    
-    # تقسيم المسار إلى أجزاء
-    path_segments = path_part.split('/')
-    first_segment = path_segments[0]
-    
-    # رفض إذا كان هناك أكثر من جزء (مثال: t.me/username/123)
-    if len(path_segments) > 1:
-        return False
-    
+
     # رفض الروابط التي تبدو كأرقام هواتف (مثل t.me/+123456789)
-    if first_segment.startswith('+') and len(first_segment) <= 12:
-        # إذا كان الرقم قصير (مثل +123456789) فهو رقم هاتف
-        # أرقام الهواتف عادة بين 7-12 رقم مع +
-        remaining = first_segment[1:]
-        if remaining.isdigit() and 7 <= len(remaining) <= 12:
-            return False
-    
-    # قبول فقط إذا كان:
-    # 1. يبدأ بـ + ويتبعه أحرف/أرقام
-    # 2. أو يتكون فقط من أحرف وأرقام وشرطة سفلية وشرطة
-    if first_segment.startswith('+'):
-        # التحقق من أن ما بعد + يحتوي على أحرف صالحة
-        remaining = first_segment[1:]
-        if not remaining.replace('_', '').replace('-', '').isalnum():
-            return False
-        return True
-    else:
-        # رابط بدون +
-        if not first_segment.replace('_', '').replace('-', '').isalnum():
-            return False
-        return True
+    return not TME_PHONE_REGEX.match(m.group(1))
+
+
+def clear_classification_caches():
+    """تفريغ كاشات التصنيف — مفيد عند تغيّر قواعد الفلترة أثناء التشغيل"""
+    filter_and_classify_link.cache_clear()
+    is_valid_telegram_link.cache_clear()
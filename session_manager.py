@@ -1,4 +1,7 @@
+import asyncio
+import atexit
 import sqlite3
+import threading
 import uuid
 import logging
 from datetime import datetime
@@ -7,6 +10,11 @@ from telethon.sessions import StringSession
 from telethon.tl.functions.account import GetAuthorizationsRequest
 
 from config import API_ID, API_HASH, DATABASE_PATH
+from database import (
+    connection_generation,
+    register_connection,
+    unregister_connection,
+)
 
 # ======================
 # Logging
@@ -18,19 +26,80 @@ logger = logging.getLogger(__name__)
 # Database Helpers
 # ======================
 
+# اتصال مخزّن لكل خيط — إعادة الفتح عند كل عملية كانت تدفع
+# ثمن فتح الاتصال وكل الـ PRAGMAs في كل استدعاء
+_tls = threading.local()
+
+# حارس تهيئة الجدول: الـ DDL يُنفَّذ مرة واحدة لكل عملية تشغيل
+_tables_ready = False
+
+
 def get_connection():
-    """إنشاء اتصال بقاعدة البيانات مع تحسينات الأداء"""
-    conn = sqlite3.connect(DATABASE_PATH)
+    """اتصال واحد مخزّن لكل خيط مع تحسينات الأداء"""
+    conn = getattr(_tls, "conn", None)
+    if conn is not None:
+        if getattr(_tls, "generation", -1) == connection_generation():
+            return conn
+        # اتصال من جيل قديم — ملف القاعدة استُبدل باستعادة نسخة
+        try:
+            conn.close()
+        except sqlite3.Error:
+            pass
+        _tls.conn = None
+
+    # isolation_level=None: وضع autocommit صريح —
+    # العمليات متعددة الجمل تفتح معاملاتها بنفسها بـ BEGIN IMMEDIATE
+    # check_same_thread=False حتى تستطيع الاستعادة إغلاقه من خيط آخر
+    conn = sqlite3.connect(
+        DATABASE_PATH,
+        isolation_level=None,
+        check_same_thread=False,
+        timeout=30
+    )
     conn.execute("PRAGMA journal_mode = WAL")
+    conn.execute("PRAGMA synchronous = NORMAL")
+    conn.execute("PRAGMA temp_store = MEMORY")
+    conn.execute("PRAGMA mmap_size = 268435456")
+    conn.execute("PRAGMA cache_size = -65536")
+    conn.execute("PRAGMA busy_timeout = 5000")
+
+    # صفوف قابلة للوصول بالاسم وبالموضع معاً بلا نسخ إضافي
+    conn.row_factory = sqlite3.Row
+
+    _tls.conn = conn
+    # التسجيل في سجل database حتى تغلقه invalidate_connections
+    # عند الاستعادة — وإلا بقي يمسك أقفال WAL على الملف القديم
+    _tls.generation = connection_generation()
+    register_connection(conn)
     return conn
 
 
+def close_connection():
+    """إغلاق اتصال الخيط الحالي إن وُجد"""
+    conn = getattr(_tls, "conn", None)
+    if conn is not None:
+        unregister_connection(conn)
+        try:
+            conn.close()
+        except sqlite3.Error:
+            pass
+        _tls.conn = None
+
+
+atexit.register(close_connection)
+
+
 def init_sessions_table():
-    """إنشاء جدول الجلسات مع تحسينات"""
+    """إنشاء جدول الجلسات مع تحسينات (مرة واحدة لكل تشغيل)"""
+    global _tables_ready
+    if _tables_ready:
+        return
+
     conn = get_connection()
-    cur = conn.cursor()
 
-    cur.execute("""
+    # دفعة DDL واحدة عبر executescript بدل أربع جولات منفصلة
+    # عبر المحلل، مع PRAGMA optimize لتحديث إحصائيات المخطط
+    conn.executescript("""
         CREATE TABLE IF NOT EXISTS sessions (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             name TEXT NOT NULL,
@@ -41,27 +110,32 @@ def init_sessions_table():
             last_used TEXT,
             status TEXT DEFAULT 'active',  -- active, expired, error
             note TEXT
-        )
-    """)
+        );
 
-    # إنشاء فهارس للبحث السريع
-    cur.execute("""
-        CREATE INDEX IF NOT EXISTS idx_sessions_status 
-        ON sessions(status)
-    """)
-    
-    cur.execute("""
-        CREATE INDEX IF NOT EXISTS idx_sessions_phone 
-        ON sessions(phone)
-    """)
-    
-    cur.execute("""
-        CREATE INDEX IF NOT EXISTS idx_sessions_user_id 
-        ON sessions(user_id)
+        CREATE INDEX IF NOT EXISTS idx_sessions_status
+        ON sessions(status);
+
+        CREATE INDEX IF NOT EXISTS idx_sessions_phone
+        ON sessions(phone);
+
+        CREATE INDEX IF NOT EXISTS idx_sessions_user_id
+        ON sessions(user_id);
+
+        PRAGMA optimize;
     """)
 
+    # قيد فريد جزئي على الهاتف — يحسم التكرار عند الإدراج مباشرة
+    # بدل استعلام فحص مسبق؛ قواعد قديمة قد تحوي تكرارات فنتجاوز بحذر
+    try:
+        conn.execute("""
+            CREATE UNIQUE INDEX IF NOT EXISTS ux_sessions_phone
+            ON sessions(phone) WHERE phone != 'Unknown'
+        """)
+    except sqlite3.IntegrityError as e:
+        logger.warning(f"Could not enforce unique phones (duplicates exist): {e}")
+
     conn.commit()
-    conn.close()
+    _tables_ready = True
 
 
 # ======================
@@ -123,16 +197,8 @@ async def validate_session(session_string: str) -> dict:
 # Session Operations
 # ======================
 
-async def add_session(session_string: str, custom_name: str = None):
-    """
-    إضافة Session String مع التحقق من صحته
-    """
-    init_sessions_table()
-    
-    # التحقق من صحة الـ Session
-    account_info = await validate_session(session_string)
-    
-    # إنشاء اسم للحساب
+def _make_account_name(account_info: dict, custom_name: str = None) -> str:
+    """إنشاء اسم للحساب من معلوماته (مشترك بين الإضافة والاستيراد)"""
     if custom_name:
         account_name = custom_name
     else:
@@ -143,31 +209,38 @@ async def add_session(session_string: str, custom_name: str = None):
             account_name = f"Account-{phone_suffix}"
         else:
             account_name = f"Account-{uuid.uuid4().hex[:6]}"
-    
+
     # إضافة معلومات إضافية للاسم
     if account_info["first_name"]:
         account_name = f"{account_info['first_name']} ({account_name})"
-    
+
+    return account_name
+
+
+async def add_session(session_string: str, custom_name: str = None):
+    """
+    إضافة Session String مع التحقق من صحته
+    """
+    init_sessions_table()
+
+    # التحقق من صحة الـ Session
+    account_info = await validate_session(session_string)
+
+    # إنشاء اسم للحساب
+    account_name = _make_account_name(account_info, custom_name)
+
     conn = get_connection()
     cur = conn.cursor()
 
     try:
-        # التحقق من عدم وجود نفس الـ session مسبقاً
-        cur.execute("SELECT id FROM sessions WHERE session = ?", (session_string,))
-        if cur.fetchone():
-            raise ValueError("هذا الحساب مضاف مسبقاً")
-        
-        # التحقق من عدم وجود نفس رقم الهاتف
-        if account_info["phone"] != "Unknown":
-            cur.execute("SELECT id FROM sessions WHERE phone = ?", (account_info["phone"],))
-            if cur.fetchone():
-                raise ValueError("رقم الهاتف هذا مضاف مسبقاً")
-        
-        # إضافة الحساب
+        # قيود UNIQUE على session والهاتف تحسم التكرار عند الإدراج —
+        # جملة واحدة بدل استعلامي فحص مسبقين ثم INSERT
+        cur.execute("BEGIN IMMEDIATE")
+
         cur.execute(
             """
-            INSERT INTO sessions 
-            (name, session, phone, user_id, added_date, status) 
+            INSERT OR IGNORE INTO sessions
+            (name, session, phone, user_id, added_date, status)
             VALUES (?, ?, ?, ?, ?, ?)
             """,
             (
@@ -179,7 +252,14 @@ async def add_session(session_string: str, custom_name: str = None):
                 "active"
             )
         )
-        
+
+        if cur.rowcount == 0:
+            # استعلام توضيحي واحد في مسار التكرار النادر فقط
+            cur.execute("SELECT 1 FROM sessions WHERE session = ?", (session_string,))
+            if cur.fetchone():
+                raise ValueError("هذا الحساب مضاف مسبقاً")
+            raise ValueError("رقم الهاتف هذا مضاف مسبقاً")
+
         conn.commit()
         
         logger.info(f"Session added successfully: {account_name}")
@@ -191,15 +271,14 @@ async def add_session(session_string: str, custom_name: str = None):
         }
         
     except sqlite3.IntegrityError as e:
+        conn.rollback()
         logger.error(f"Database integrity error: {e}")
         raise ValueError("هذا الحساب مضاف مسبقاً")
-        
+
     except Exception as e:
+        conn.rollback()
         logger.error(f"Error adding session: {e}")
         raise
-        
-    finally:
-        conn.close()
 
 
 async def update_session_status(session_id: int, status: str, note: str = None):
@@ -209,31 +288,68 @@ async def update_session_status(session_id: int, status: str, note: str = None):
     try:
         conn = get_connection()
         cur = conn.cursor()
-        
-        update_data = {
-            "status": status,
-            "last_used": datetime.now().isoformat()
-        }
-        
-        if note:
-            update_data["note"] = note
-        
-        query = """
-            UPDATE sessions 
-            SET status = ?, last_used = ?, note = ?
-            WHERE id = ?
-        """
-        
-        cur.execute(query, (status, update_data["last_used"], note, session_id))
+
+        last_used = datetime.now().isoformat()
+
+        # تحديث جزئي: غياب note يعني الإبقاء على الملاحظة الحالية
+        # بدل الكتابة فوقها بـ NULL
+        if note is not None:
+            cur.execute(
+                "UPDATE sessions SET status = ?, last_used = ?, note = ? WHERE id = ?",
+                (status, last_used, note, session_id)
+            )
+        else:
+            cur.execute(
+                "UPDATE sessions SET status = ?, last_used = ? WHERE id = ?",
+                (status, last_used, session_id)
+            )
         conn.commit()
-        conn.close()
-        
+
         logger.info(f"Session {session_id} status updated to {status}")
-        
+
     except Exception as e:
         logger.error(f"Error updating session status: {e}")
 
 
+def _update_statuses_bulk(rows):
+    """
+    تحديث حالة عدة جلسات في معاملة واحدة
+    rows: قائمة (status, last_used, note, id)
+    fsync واحد بدل واحد لكل جلسة في فحص الصحة
+    """
+    if not rows:
+        return
+    try:
+        conn = get_connection()
+        cur = conn.cursor()
+        cur.execute("BEGIN IMMEDIATE")
+        cur.executemany(
+            "UPDATE sessions SET status = ?, last_used = ?, note = ? WHERE id = ?",
+            rows
+        )
+        conn.commit()
+    except Exception as e:
+        logger.error(f"Error bulk-updating session statuses: {e}")
+
+
+_SESSION_COLUMNS = "id, name, session, phone, user_id, added_date, last_used, status, note"
+
+
+def _row_to_dict(row) -> dict:
+    """تحويل صف sessions إلى قاموس بنفس ترتيب _SESSION_COLUMNS"""
+    return {
+        "id": row[0],
+        "name": row[1],
+        "session": row[2],
+        "phone": row[3],
+        "user_id": row[4],
+        "added_date": row[5],
+        "last_used": row[6],
+        "status": row[7],
+        "note": row[8]
+    }
+
+
 def get_all_sessions():
     """
     إرجاع كل الحسابات المضافة
@@ -243,47 +359,58 @@ def get_all_sessions():
     conn = get_connection()
     cur = conn.cursor()
 
-    cur.execute("""
-        SELECT id, name, session, phone, user_id, added_date, last_used, status, note 
-        FROM sessions 
+    cur.execute(f"""
+        SELECT {_SESSION_COLUMNS}
+        FROM sessions
         ORDER BY added_date DESC
     """)
-    
-    rows = cur.fetchall()
-
-    conn.close()
-
-    return [
-        {
-            "id": row[0],
-            "name": row[1],
-            "session": row[2],
-            "phone": row[3],
-            "user_id": row[4],
-            "added_date": row[5],
-            "last_used": row[6],
-            "status": row[7],
-            "note": row[8]
-        }
-        for row in rows
-    ]
+
+    return [_row_to_dict(row) for row in cur.fetchall()]
 
 
 def get_active_sessions():
     """
     إرجاع الحسابات النشطة فقط
+    الفلترة في SQL عبر فهرس idx_sessions_status —
+    لا بناء قواميس للصفوف المنتهية أو المعطوبة
     """
-    all_sessions = get_all_sessions()
-    return [s for s in all_sessions if s["status"] == "active"]
+    init_sessions_table()
+
+    conn = get_connection()
+    cur = conn.cursor()
+
+    cur.execute(f"""
+        SELECT {_SESSION_COLUMNS}
+        FROM sessions
+        WHERE status = 'active'
+        ORDER BY added_date DESC
+    """)
+
+    return [_row_to_dict(row) for row in cur.fetchall()]
+
+
+def get_session_by_id(session_id: int):
+    """إرجاع جلسة واحدة بمعرفها أو None"""
+    init_sessions_table()
+
+    conn = get_connection()
+    cur = conn.cursor()
+
+    cur.execute(
+        f"SELECT {_SESSION_COLUMNS} FROM sessions WHERE id = ?",
+        (session_id,)
+    )
+    row = cur.fetchone()
+    return _row_to_dict(row) if row else None
 
 
 async def test_session(session_id: int) -> dict:
     """
     اختبار جلسة محددة
     """
-    sessions = get_all_sessions()
-    session_data = next((s for s in sessions if s["id"] == session_id), None)
-    
+    # استعلام صف واحد بدل تحميل كل الجلسات والبحث في بايثون
+    session_data = get_session_by_id(session_id)
+
     if not session_data:
         raise ValueError("Session not found")
     
@@ -335,11 +462,12 @@ def delete_session(session_id: int):
     if session_info:
         logger.info(f"Deleting session: {session_info[0]} ({session_info[1]})")
 
+    # rowcount يخص جملة DELETE هذه فقط —
+    # total_changes تراكمي على عمر الاتصال المخزّن للخيط
     cur.execute("DELETE FROM sessions WHERE id = ?", (session_id,))
-    deleted_count = conn.total_changes
+    deleted_count = cur.rowcount
 
     conn.commit()
-    conn.close()
     
     return deleted_count > 0
 
@@ -353,16 +481,14 @@ def delete_all_sessions():
     conn = get_connection()
     cur = conn.cursor()
 
-    cur.execute("SELECT COUNT(*) FROM sessions")
-    count_before = cur.fetchone()[0]
-    
+    # حذف بلا WHERE يستفيد من تحسين truncate في SQLite
+    # و rowcount يغني عن مسح COUNT(*) مسبق
     cur.execute("DELETE FROM sessions")
-    deleted_count = conn.total_changes
+    deleted_count = cur.rowcount
 
     conn.commit()
-    conn.close()
-    
-    logger.info(f"Deleted {deleted_count} sessions out of {count_before}")
+
+    logger.info(f"Deleted {deleted_count} sessions")
     return deleted_count
 
 
@@ -375,30 +501,26 @@ def get_session_stats() -> dict:
     conn = get_connection()
     cur = conn.cursor()
 
+    # الإحصائيات الأساسية — تجميع شرطي في استعلام واحد
+    # بدل GROUP BY ثم فرز النتائج في بايثون
+    cur.execute("""
+        SELECT
+            COUNT(*) AS total,
+            SUM(CASE WHEN status = 'active' THEN 1 ELSE 0 END) AS active,
+            SUM(CASE WHEN status = 'expired' THEN 1 ELSE 0 END) AS expired,
+            SUM(CASE WHEN status = 'error' THEN 1 ELSE 0 END) AS error
+        FROM sessions
+    """)
+    row = cur.fetchone()
+
     stats = {
-        "total": 0,
-        "active": 0,
-        "expired": 0,
-        "error": 0,
+        "total": row["total"],
+        "active": row["active"] or 0,
+        "expired": row["expired"] or 0,
+        "error": row["error"] or 0,
         "by_month": []
     }
 
-    # الإحصائيات الأساسية
-    cur.execute("""
-        SELECT status, COUNT(*) 
-        FROM sessions 
-        GROUP BY status
-    """)
-    
-    for status, count in cur.fetchall():
-        stats["total"] += count
-        if status == "active":
-            stats["active"] = count
-        elif status == "expired":
-            stats["expired"] = count
-        elif status == "error":
-            stats["error"] = count
-
     # الإحصائيات الشهرية
     cur.execute("""
         SELECT 
@@ -415,7 +537,6 @@ def get_session_stats() -> dict:
         for row in cur.fetchall()
     ]
 
-    conn.close()
     return stats
 
 
@@ -423,44 +544,52 @@ def get_session_stats() -> dict:
 # Session Health Check
 # ======================
 
+# عدد الفحوصات المتزامنة في فحص الصحة الشامل
+HEALTH_CHECK_CONCURRENCY = 10
+
+
 async def check_all_sessions_health():
     """
     التحقق من صحة جميع الجلسات
     """
     sessions = get_all_sessions()
-    results = []
-    
-    for session in sessions:
-        try:
-            account_info = await validate_session(session["session"])
-            
-            # تحديث حالة الجلسة
-            await update_session_status(session["id"], "active", "Health check passed")
-            
-            results.append({
-                "id": session["id"],
-                "name": session["name"],
-                "status": "healthy",
-                "phone": account_info["phone"],
-                "user_id": account_info["user_id"]
-            })
-            
-        except Exception as e:
-            # تحديث حالة الجلسة
-            await update_session_status(
-                session["id"], 
-                "error", 
-                f"Health check failed: {str(e)}"
-            )
-            
-            results.append({
-                "id": session["id"],
-                "name": session["name"],
-                "status": "unhealthy",
-                "error": str(e),
-                "phone": session["phone"]
-            })
-    
+
+    # الفحوصات مستقلة وكل واحدة جولة شبكة كاملة —
+    # تشغيلها بالتوازي يجعل الزمن الكلي أقرب إلى أبطأ فحص بدل مجموعها
+    # الحد الأقصى مضبوط حتى لا نغرق تليجرام بالاتصالات
+    sem = asyncio.Semaphore(HEALTH_CHECK_CONCURRENCY)
+    updates = []
+
+    async def _check_one(session):
+        async with sem:
+            now = datetime.now().isoformat()
+            try:
+                account_info = await validate_session(session["session"])
+
+                updates.append(("active", now, "Health check passed", session["id"]))
+                return {
+                    "id": session["id"],
+                    "name": session["name"],
+                    "status": "healthy",
+                    "phone": account_info["phone"],
+                    "user_id": account_info["user_id"]
+                }
+
+            except Exception as e:
+                updates.append(("error", now, f"Health check failed: {str(e)}", session["id"]))
+                return {
+                    "id": session["id"],
+                    "name": session["name"],
+                    "status": "unhealthy",
+                    "error": str(e),
+                    "phone": session["phone"]
+                }
+
+    results = list(await asyncio.gather(*(_check_one(s) for s in sessions)))
+
+    # كتابة كل التحديثات دفعة واحدة بعد انتهاء الفحوصات
+    _update_statuses_bulk(updates)
+
     return results
 
 
@@ -468,30 +597,51 @@ async def check_all_sessions_health():
 # Export/Import Sessions
 # ======================
 
+# عدد عمليات التحقق المتزامنة أثناء الاستيراد
+IMPORT_CONCURRENCY = 10
+
+
 def export_sessions_to_file(filepath: str = "sessions_export.txt") -> bool:
     """
     تصدير الجلسات إلى ملف نصي
     """
     try:
-        sessions = get_all_sessions()
-        
-        with open(filepath, "w", encoding="utf-8") as f:
+        init_sessions_table()
+
+        conn = get_connection()
+        cur = conn.cursor()
+
+        cur.execute("SELECT COUNT(*) FROM sessions")
+        total = cur.fetchone()[0]
+
+        # بث مباشر من المؤشر إلى الملف —
+        # لا قائمة قواميس وسيطة لكل الجلسات في الذاكرة
+        cur.execute("""
+            SELECT id, name, phone, status, added_date, session
+            FROM sessions
+            ORDER BY added_date DESC
+        """)
+
+        separator = "-" * 50
+        with open(filepath, "w", encoding="utf-8", buffering=1 << 20) as f:
             f.write("# Telegram Sessions Export\n")
             f.write(f"# Export Date: {datetime.now().isoformat()}\n")
-            f.write(f"# Total Sessions: {len(sessions)}\n\n")
-            
-            for session in sessions:
-                f.write(f"# ID: {session['id']}\n")
-                f.write(f"# Name: {session['name']}\n")
-                f.write(f"# Phone: {session['phone']}\n")
-                f.write(f"# Status: {session['status']}\n")
-                f.write(f"# Added: {session['added_date']}\n")
-                f.write(f"{session['session']}\n")
-                f.write("-" * 50 + "\n\n")
-        
+            f.write(f"# Total Sessions: {total}\n\n")
+
+            for row in cur:
+                f.write(
+                    f"# ID: {row[0]}\n"
+                    f"# Name: {row[1]}\n"
+                    f"# Phone: {row[2]}\n"
+                    f"# Status: {row[3]}\n"
+                    f"# Added: {row[4]}\n"
+                    f"{row[5]}\n"
+                    f"{separator}\n\n"
+                )
+
         logger.info(f"Sessions exported to {filepath}")
         return True
-        
+
     except Exception as e:
         logger.error(f"Error exporting sessions: {e}")
         return False
@@ -511,38 +661,74 @@ async def import_sessions_from_file(filepath: str) -> dict:
     try:
         with open(filepath, "r", encoding="utf-8") as f:
             content = f.read()
-        
-        # استخراج الجلسات من الملف
-        lines = content.split('\n')
-        current_session = None
-        session_lines = []
-        
-        for line in lines:
-            line = line.strip()
-            
-            if line.startswith('#'):
-                continue
-            
-            if line and not line.startswith('-'):
-                session_lines.append(line)
-            
-            if len(session_lines) == 1:  # نحتاج فقط سطر واحد للـ session string
-                session_string = session_lines[0].strip()
-                if session_string:
-                    results["total"] += 1
-                    
-                    try:
-                        await add_session(session_string)
-                        results["success"] += 1
-                    except Exception as e:
-                        results["failed"] += 1
-                        results["errors"].append(str(e))
-                    
-                    session_lines = []
-        
+
+        # تمريرة واحدة تلتقط أسطر الجلسات وتتجاهل التعليقات والفواصل
+        candidates = [
+            stripped for line in content.splitlines()
+            if (stripped := line.strip()) and not stripped.startswith(('#', '-'))
+        ]
+        results["total"] = len(candidates)
+
+        if not candidates:
+            return results
+
+        # تحقق متوازٍ — كل تحقق جولة شبكة مستقلة
+        # والحد الأقصى يحمي من إغراق تليجرام بالاتصالات
+        sem = asyncio.Semaphore(IMPORT_CONCURRENCY)
+
+        async def _validate_one(session_string):
+            async with sem:
+                return await validate_session(session_string)
+
+        infos = await asyncio.gather(
+            *(_validate_one(s) for s in candidates),
+            return_exceptions=True
+        )
+
+        # إدراج كل النجاحات في معاملة واحدة
+        init_sessions_table()
+        conn = get_connection()
+        cur = conn.cursor()
+
+        try:
+            cur.execute("BEGIN IMMEDIATE")
+            now = datetime.now().isoformat()
+
+            for session_string, info in zip(candidates, infos):
+                if isinstance(info, BaseException):
+                    results["failed"] += 1
+                    results["errors"].append(str(info))
+                    continue
+
+                cur.execute(
+                    """
+                    INSERT OR IGNORE INTO sessions
+                    (name, session, phone, user_id, added_date, status)
+                    VALUES (?, ?, ?, ?, ?, 'active')
+                    """,
+                    (
+                        _make_account_name(info),
+                        session_string,
+                        info["phone"],
+                        info["user_id"],
+                        now
+                    )
+                )
+
+                if cur.rowcount:
+                    results["success"] += 1
+                else:
+                    results["failed"] += 1
+                    results["errors"].append("هذا الحساب مضاف مسبقاً")
+
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
         logger.info(f"Sessions import completed: {results}")
         return results
-        
+
     except Exception as e:
         logger.error(f"Error importing sessions: {e}")
         results["errors"].append(str(e))